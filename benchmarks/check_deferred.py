@@ -0,0 +1,103 @@
+"""
+Checks that deferred mode builds the same datasets as the eager methods, on a synthetic stand-in for the WRDS database
+(see fake_wrds.py). No access to WRDS is required. Run from the root of the repository, e.g.:
+
+    python -m benchmarks.check_deferred --companies 1000
+"""
+import argparse
+
+from datetime import date
+
+import pandas as pd
+
+from benchmarks.fake_wrds import FakeWrdsConnection
+from wrds_tools import SharedTableStore, WrdsConnection
+
+
+def _two_industry_filters(wrds: WrdsConnection):
+    wrds.build_sp500()
+    wrds.filter_by_industry(['3674'], 'SIC')
+    wrds.filter_by_industry(['7372', '3674'], 'SIC')
+
+
+def _industry_filters_and_names(wrds: WrdsConnection):
+    wrds.build_sp500()
+    wrds.filter_by_industry(['3674', '7372', '2834'], 'SIC')
+    wrds.filter_by_industry('3674', 'SIC')
+    wrds.add_names()
+    wrds.add_address()
+
+
+def _executives(wrds: WrdsConnection):
+    wrds.build_sp500()
+    wrds.filter_by_industry(['3674', '7372'], 'SIC')
+    wrds.add_executives()
+
+
+# Name of the check -> sequence of methods that is run in both modes.
+CHECKS = {
+    'two_industry_filters': _two_industry_filters,
+    'industry_filters_and_names': _industry_filters_and_names,
+    'executives': _executives,
+}
+
+
+def _connection(db: FakeWrdsConnection):
+    return WrdsConnection('check', selection_start_date=date(2000, 1, 1), selection_end_date=date(2015, 12, 31),
+                          observation_start_date=date(2000, 1, 1), observation_end_date=date(2015, 12, 31), db=db,
+                          table_store=SharedTableStore())
+
+
+def _normalized(df: pd.DataFrame, columns: list):
+    # The modes can return the columns with different types (e.g., integers or floats, categories or strings), so
+    # numbers are compared as floats and all columns as strings, in the same order.
+    keys = [column for column in ['gvkey', 'year', 'execid'] if column in columns]
+    df = df[columns].apply(lambda column: column.astype('float64') if pd.api.types.is_numeric_dtype(column) else column)
+    return df.astype(str).sort_values(keys).reset_index(drop=True)
+
+
+def run_check(db: FakeWrdsConnection, name: str):
+    """
+    Runs a check once eagerly and once in deferred mode.
+    :return: Tuple of the number of rows of both datasets, and a list of the shared columns whose values differ.
+    """
+    eager = _connection(db)
+    CHECKS[name](eager)
+    deferred = _connection(db)
+    deferred.defer()
+    CHECKS[name](deferred)
+    deferred.collect()
+
+    columns = [column for column in eager.dataset.columns if column in deferred.dataset.columns]
+    if len(eager.dataset) != len(deferred.dataset):
+        return (len(eager.dataset), len(deferred.dataset)), columns
+    eager_values, deferred_values = _normalized(eager.dataset, columns), _normalized(deferred.dataset, columns)
+    differences = [column for column in columns if not eager_values[column].equals(deferred_values[column])]
+    return (len(eager.dataset), len(deferred.dataset)), differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=1000, help='Number of companies in the synthetic tables.')
+    parser.add_argument('--checks', nargs='+', default=list(CHECKS), choices=list(CHECKS),
+                        help='Checks to run. Runs all checks by default.')
+    args = parser.parse_args()
+
+    db = FakeWrdsConnection(companies=args.companies)
+    failed = []
+    try:
+        for name in args.checks:
+            (eager_rows, deferred_rows), differences = run_check(db, name)
+            status = 'ok' if eager_rows == deferred_rows and not differences else 'FAILED'
+            print('{0:<30} {1:>8} eager rows {2:>8} deferred rows  {3} {4}'.format(
+                name, eager_rows, deferred_rows, status, ', '.join(differences)))
+            if status != 'ok':
+                failed.append(name)
+    finally:
+        db.close()
+    if failed:
+        raise SystemExit('Deferred mode differs from eager mode in: {0}.'.format(', '.join(failed)))
+
+
+if __name__ == '__main__':
+    main()
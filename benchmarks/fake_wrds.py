@@ -0,0 +1,168 @@
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# Query parameters in the psycopg2 style used by WrdsConnection, e.g., %(gvkeys)s.
+_PARAMETER = re.compile(r'%\((\w+)\)s')
+
+
+def _translate_parameters(connection, cursor, statement, parameters, context, executemany):
+    """
+    Translates queries written for the WRDS PostgreSQL server (through psycopg2) into SQLite queries. Parameters become
+    named SQLite parameters, and tuples are expanded into lists of parameters, as psycopg2 does for "in" conditions.
+    """
+    if executemany or not isinstance(parameters, dict):
+        return _PARAMETER.sub(r':\1', statement), parameters
+
+    translated = {}
+
+    def replace(match):
+        name = match.group(1)
+        value = parameters[name]
+        if isinstance(value, (tuple, list)):
+            names = ['{0}_{1}'.format(name, i) for i in range(len(value))]
+            translated.update(zip(names, value))
+            return '(' + ', '.join(':' + item for item in names) + ')'
+        translated[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+        return ':' + name
+
+    return _PARAMETER.sub(replace, statement).replace('%%', '%'), translated
+
+
+def _concat_ws(separator, *values):
+    """
+    PostgreSQL's concat_ws, which SQLite only provides from version 3.44: joins the values that are not missing.
+    """
+    return separator.join(str(value) for value in values if value is not None)
+
+
+class FakeWrdsConnection:
+    """
+    A local stand-in for the WRDS database, for benchmarks that run without access to WRDS. The tables used by
+    WrdsConnection ("IDXCST_HIS", "NAMES" and "COMPANY" in the "COMPA" library, "ANNCOMP" in the "EXECCOMP" library and
+    "FUNDA" in the "COMPA" library) are filled with synthetic data and stored in SQLite databases, one per library.
+    Like wrds.Connection, the object provides an SQLAlchemy engine as its engine attribute, and the raw_sql and get_table
+    methods. Pass it to WrdsConnection with the db parameter.
+
+    :param companies: Number of companies. All tables grow in proportion to it.
+    :param first_year: First year of the executive and annual tables.
+    :param last_year: Last year of the executive and annual tables.
+    :param executives: Number of executives per company and year.
+    :param seed: Seed of the random number generator, so that the data is the same every time.
+    """
+    def __init__(self, companies=1000, first_year=1995, last_year=2019, executives=5, seed=0):
+        self.companies = companies
+        self.directory = tempfile.mkdtemp(prefix='fake_wrds_')
+        self.engine = sqlalchemy.create_engine('sqlite:///' + os.path.join(self.directory, 'main.db'))
+        sqlalchemy.event.listen(self.engine, 'connect', self._attach_libraries)
+        sqlalchemy.event.listen(self.engine, 'before_cursor_execute', _translate_parameters, retval=True)
+
+        tables = synthetic_tables(companies, first_year, last_year, executives, np.random.default_rng(seed))
+        for (library, table), df in tables.items():
+            df.to_sql(table, self.engine, schema=library, index=False, chunksize=100000)
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql('create index {0}.{1}_gvkey on {1} (gvkey)'.format(library, table))
+
+    def _attach_libraries(self, dbapi_connection, connection_record):
+        # Every library is a database of its own, so that tables can be addressed as library.table, as on WRDS.
+        for library in ['compa', 'execcomp']:
+            dbapi_connection.execute("attach database '{0}' as {1}".format(
+                os.path.join(self.directory, library + '.db'), library))
+        dbapi_connection.create_function('concat_ws', -1, _concat_ws, deterministic=True)
+
+    def raw_sql(self, sql: str, params: dict = None, date_cols: list = None, chunksize=None):
+        with self.engine.connect() as connection:
+            return pd.read_sql_query(sql, connection, params=params, parse_dates=date_cols, chunksize=chunksize)
+
+    def get_table(self, library: str, table: str, columns: list = None, obs: int = None):
+        sql = 'select {columns} from {library}.{table}'.format(
+            columns=', '.join(columns) if columns is not None else '*', library=library, table=table)
+        if obs is not None:
+            sql += ' limit {0}'.format(int(obs))
+        return self.raw_sql(sql)
+
+    def close(self):
+        """
+        Closes the connection and removes the databases.
+        """
+        self.engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def synthetic_tables(companies: int, first_year: int, last_year: int, executives: int, rng: np.random.Generator):
+    """
+    Generates the synthetic tables.
+    :return: Dictionary mapping tuples of library and table name to Pandas dataframes.
+    """
+    gvkeys = np.array(['{0:06d}'.format(i) for i in range(1, companies + 1)])
+    years = np.arange(first_year, last_year + 1)
+    start = np.datetime64('{0}-01-01'.format(first_year))
+    days = int((np.datetime64('{0}-12-31'.format(last_year)) - start).astype(int))
+
+    # Most companies have one spell in one of two indices. Some left the index and joined again later, and some are
+    # still in the index (no thru date).
+    rejoined = rng.random(companies) < 0.1
+    constituent_gvkeys = np.concatenate([gvkeys, gvkeys[rejoined]])
+    joined = rng.integers(0, days - 400, len(constituent_gvkeys))
+    joined[companies:] = np.minimum(joined[:companies][rejoined] + rng.integers(800, 2000, rejoined.sum()), days - 1)
+    left = joined + rng.integers(200, 3000, len(constituent_gvkeys))
+    from_dates = (start + joined.astype('timedelta64[D]')).astype(str)
+    thru_dates = (start + left.astype('timedelta64[D]')).astype(str).astype(object)
+    thru_dates[(left >= days) | (rng.random(len(left)) < 0.15)] = None
+    idxcst_his = pd.DataFrame({'gvkey': constituent_gvkeys, 'iid': '01',
+                               'gvkeyx': np.where(rng.random(len(constituent_gvkeys)) < 0.7, '000003', '000010'),
+                               'from': from_dates, 'thru': thru_dates})
+    idxcst_his = idxcst_his.sort_values(['gvkey', 'from'], ignore_index=True)
+
+    sic = rng.choice(['3674', '2834', '6021', '7372', '1311', '4911'], companies)
+    names = pd.DataFrame({'gvkey': gvkeys, 'conm': np.char.add('COMPANY ', gvkeys),
+                          'tic': np.char.add('T', gvkeys), 'cusip': np.char.add('C', gvkeys),
+                          'cik': np.char.add('K', gvkeys), 'sic': sic,
+                          'naics': pd.Series(sic).map({'3674': '334413', '2834': '325412', '6021': '522110',
+                                                       '7372': '511210', '1311': '211120', '4911': '221112'}),
+                          'year1': rng.integers(1950, first_year, companies).astype(float),
+                          'year2': rng.integers(first_year, last_year + 1, companies).astype(float),
+                          'ipodate': (start - rng.integers(0, 10000, companies).astype('timedelta64[D]')).astype(str)})
+
+    gsubind = rng.choice(['45301020', '35202010', '40101015', '45103020', '10102020', '55101010'], companies)
+    address_lines = rng.integers(1, 5, companies)
+    company = pd.DataFrame({'gvkey': gvkeys, 'conm': names['conm'], 'ggroup': [code[:4] for code in gsubind],
+                            'gind': [code[:6] for code in gsubind], 'gsector': [code[:2] for code in gsubind],
+                            'gsubind': gsubind, 'spcindcd': rng.choice([100.0, 110.0, 215.0, 355.0], companies),
+                            'spcseccd': rng.choice([800.0, 940.0, 976.0], companies),
+                            'state': rng.choice(['CA', 'NY', 'TX', 'WA'], companies), 'fic': 'USA', 'loc': 'USA'})
+    for line in range(1, 5):
+        company['add{0}'.format(line)] = np.where(address_lines >= line,
+                                                  np.char.add('{0} LINE '.format(line), gvkeys), None)
+
+    company_years = len(gvkeys) * len(years)
+    rows = company_years * executives
+    anncomp = pd.DataFrame({'gvkey': np.repeat(gvkeys, len(years) * executives),
+                            'year': np.tile(np.repeat(years, executives), companies).astype(float),
+                            'execid': np.char.add(np.repeat(gvkeys, len(years) * executives),
+                                                  np.tile(np.arange(executives).astype(str), company_years)),
+                            'co_per_rol': rng.integers(1, 10 ** 6, rows).astype(str),
+                            'ceoann': np.where(np.tile(np.arange(executives), company_years) == 0, 'CEO', None),
+                            'cfoann': np.where(np.tile(np.arange(executives), company_years) == 1, 'CFO', None),
+                            'titleann': rng.choice(['CEO', 'CFO', 'COO', 'EVP', 'General Counsel'], rows),
+                            'exec_fullname': np.char.add('EXECUTIVE ', rng.integers(0, companies * executives * 2,
+                                                                                   rows).astype(str)),
+                            'salary': rng.gamma(2, 300, rows), 'bonus': rng.gamma(1, 200, rows)})
+
+    funda = pd.DataFrame({'gvkey': np.repeat(gvkeys, len(years)), 'fyear': np.tile(years, companies).astype(float),
+                          'indfmt': 'INDL', 'consol': 'C', 'datafmt': 'STD', 'popsrc': 'D', 'curcd': 'USD',
+                          'tic': np.repeat(names['tic'].to_numpy(), len(years)), 'fyr': 12.0, 'fyrc': 12.0})
+    for column in ['revt', 'xrd', 'xstfws', 'ct', 'cogs', 'ebit', 'ebitda', 'at', 'lt', 'ni', 'sale', 'oibdp']:
+        funda[column] = rng.lognormal(5, 2, company_years)
+    # FUNDA has some duplicate company-years with mostly missing values.
+    duplicates = funda.sample(frac=0.02, random_state=int(rng.integers(0, 2 ** 31)))
+    duplicates[['revt', 'xrd', 'xstfws', 'ct', 'cogs', 'ebit', 'ebitda']] = np.nan
+    funda = pd.concat([funda, duplicates], ignore_index=True)
+
+    return {('compa', 'idxcst_his'): idxcst_his, ('compa', 'names'): names, ('compa', 'company'): company,
+            ('execcomp', 'anncomp'): anncomp, ('compa', 'funda'): funda}
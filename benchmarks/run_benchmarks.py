@@ -0,0 +1,184 @@
+"""
+Times the main operations of WrdsConnection, and measures their peak memory use, on a synthetic stand-in for the WRDS
+database (see fake_wrds.py). No access to WRDS is required. Run from the root of the repository, e.g.:
+
+    python -m benchmarks.run_benchmarks --companies 1000 10000 --repeat 3 --output benchmarks.csv
+"""
+import argparse
+import threading
+import time
+import tracemalloc
+
+from datetime import date
+
+import pandas as pd
+
+from benchmarks.fake_wrds import FakeWrdsConnection
+from wrds_tools import SharedTableStore, WrdsConnection
+
+
+def _sample(wrds: WrdsConnection):
+    wrds.build_sp500()
+
+
+def _sample_with_executives(wrds: WrdsConnection):
+    wrds.build_sp500()
+    wrds.add_executives()
+
+
+def _pipeline(wrds: WrdsConnection):
+    wrds.build_sp500()
+    wrds.filter_by_industry(['3674', '7372'], 'SIC')
+    wrds.add_names()
+    wrds.add_industry_classifiers(get_gics=True, get_sp=True)
+    wrds.add_executives()
+    wrds.add_executive_info(add_title=True, add_full_name=True, add_salary=True, add_bonus=True, add_ceo_flag=True)
+    wrds.add_company_info(revenue=True, r_n_d=True, total_assets=True, EBIT=True)
+    wrds.add_address()
+
+
+def _deferred_pipeline(wrds: WrdsConnection):
+    wrds.defer()
+    _pipeline(wrds)
+    wrds.collect()
+
+
+# Name of the benchmark -> (untimed preparation, timed operation).
+BENCHMARKS = {
+    'build_sp500': (None, _sample),
+    'add_names': (_sample, lambda wrds: wrds.add_names()),
+    'add_names_fields': (_sample, lambda wrds: wrds.add_names_fields(list(WrdsConnection.names_fields))),
+    'add_ticker': (_sample, lambda wrds: wrds.add_ticker()),
+    'add_cusip': (_sample, lambda wrds: wrds.add_cusip()),
+    'add_cik': (_sample, lambda wrds: wrds.add_cik()),
+    'add_exit_year': (_sample, lambda wrds: wrds.add_exit_year()),
+    'add_ipo_date': (_sample, lambda wrds: wrds.add_ipo_date()),
+    'add_industry_classifiers': (_sample, lambda wrds: wrds.add_industry_classifiers(get_gics=True, get_sp=True)),
+    'add_executives': (_sample, lambda wrds: wrds.add_executives()),
+    'add_executive_info': (_sample_with_executives,
+                           lambda wrds: wrds.add_executive_info(add_title=True, add_full_name=True, add_salary=True,
+                                                                add_bonus=True, add_ceo_flag=True)),
+    'add_company_info': (_sample_with_executives,
+                         lambda wrds: wrds.add_company_info(revenue=True, r_n_d=True, total_assets=True, EBIT=True)),
+    'add_company_info_stream': (_sample_with_executives,
+                                lambda wrds: wrds.add_company_info(revenue=True, r_n_d=True, stream=True)),
+    'add_address': (_sample, lambda wrds: wrds.add_address()),
+    'filter_by_industry': (_sample, lambda wrds: wrds.filter_by_industry(['3674', '7372'], 'SIC')),
+    'filter_by_industry_pushdown': (_sample, lambda wrds: wrds.filter_by_industry(['3674', '7372'], 'SIC',
+                                                                                   pushdown=True)),
+    'pipeline': (None, _pipeline),
+    'pipeline_deferred': (None, _deferred_pipeline),
+}
+
+
+def _connection(db: FakeWrdsConnection):
+    # Every connection gets a store of its own, so that the tables are downloaded in every run.
+    return WrdsConnection('benchmark', selection_start_date=date(2000, 1, 1), selection_end_date=date(2015, 12, 31),
+                          observation_start_date=date(2000, 1, 1), observation_end_date=date(2015, 12, 31), db=db,
+                          table_store=SharedTableStore())
+
+
+class _ArrowPeak:
+    """
+    Measures the peak memory allocated by pyarrow while the context is active, which tracemalloc does not see. Under
+    pandas 3.0, strings are stored in Arrow arrays, so most of the memory used by string columns is allocated by
+    pyarrow. The allocated bytes are sampled on a background thread, so very short peaks can be missed. Measures
+    nothing if pyarrow is not installed.
+
+    :param interval: Seconds between two samples.
+    """
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = 0
+        try:
+            import pyarrow
+            self._allocated = pyarrow.total_allocated_bytes
+        except ImportError:
+            self._allocated = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self._allocated is not None:
+            self._baseline = self._allocated()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._record()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record()
+
+    def _record(self):
+        self.peak = max(self.peak, self._allocated() - self._baseline)
+
+
+def run_benchmark(db: FakeWrdsConnection, name: str, repeat=3):
+    """
+    Runs a benchmark on a new WrdsConnection for every repetition, so that no tables are reused between repetitions.
+    The operation is timed without tracing memory allocations, which slows it down, and then run once more with
+    tracemalloc, and with the memory allocated by pyarrow sampled, to measure its peak memory use.
+    :return: Dictionary with the fastest time in seconds, the peak memory in bytes allocated by Python (python_bytes)
+    and by pyarrow (arrow_bytes), their sum (peak_bytes, an upper bound, as both peaks need not occur at the same time)
+    and the rows of the dataset.
+    """
+    prepare, operation = BENCHMARKS[name]
+    times = []
+    for _ in range(repeat):
+        wrds = _connection(db)
+        if prepare is not None:
+            prepare(wrds)
+        start = time.perf_counter()
+        operation(wrds)
+        times.append(time.perf_counter() - start)
+
+    wrds = _connection(db)
+    if prepare is not None:
+        prepare(wrds)
+    tracemalloc.start()
+    try:
+        with _ArrowPeak() as arrow_peak:
+            operation(wrds)
+        _, python_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': python_peak + arrow_peak.peak, 'python_bytes': python_peak,
+            'arrow_bytes': arrow_peak.peak, 'rows': len(wrds.dataset)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, nargs='+', default=[1000],
+                        help='Numbers of companies in the synthetic tables. Each scale is benchmarked separately.')
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS),
+                        help='Benchmarks to run. Runs all benchmarks by default.')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions per benchmark.')
+    parser.add_argument('--output', help='Path of a .csv file to write the results to.')
+    args = parser.parse_args()
+
+    results = []
+    for companies in args.companies:
+        print('Generating synthetic tables for {0} companies.'.format(companies))
+        db = FakeWrdsConnection(companies=companies)
+        try:
+            for name in args.benchmarks:
+                result = run_benchmark(db, name, repeat=args.repeat)
+                results.append({'benchmark': name, 'companies': companies, **result})
+                print('{0:<30} {1:>10.3f} s {2:>10.1f} MB ({3:.1f} MB Arrow) {4:>10} rows'.format(
+                    name, result['seconds'], result['peak_bytes'] / 2 ** 20, result['arrow_bytes'] / 2 ** 20,
+                    result['rows']))
+        finally:
+            db.close()
+
+    if args.output is not None:
+        pd.DataFrame(results).to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,5 +12,6 @@ setuptools.setup(name='wrds_tools',
                  author='Julian Barg',
                  author_email='barg.julian@gmail.com',
                  packages=['wrds_tools'],
-                 install_requires=['pandas', 'wrds']
+                 install_requires=['pandas', 'wrds'],
+                 extras_require={'cache': ['pyarrow']}
                  )
@@ -0,0 +1,104 @@
+"""
+Regression tests of WrdsConnection, run against the synthetic stand-in for the WRDS database (see
+benchmarks/fake_wrds.py), so that they run without access to WRDS. Run from the root of the repository:
+
+    python -m pytest tests
+"""
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from benchmarks.check_deferred import CHECKS, _normalized, run_check
+from benchmarks.fake_wrds import FakeWrdsConnection
+from wrds_tools import SharedTableStore, TableCache, WrdsConnection, build_samples
+
+
+@pytest.fixture(scope='module')
+def db():
+    db = FakeWrdsConnection(companies=300)
+    yield db
+    db.close()
+
+
+def _connection(db, **kwargs):
+    settings = dict(selection_start_date=date(2000, 1, 1), selection_end_date=date(2015, 12, 31),
+                    observation_start_date=date(2000, 1, 1), observation_end_date=date(2015, 12, 31),
+                    table_store=SharedTableStore())
+    settings.update(kwargs)
+    return WrdsConnection('test', db=db, **settings)
+
+
+@pytest.mark.parametrize('name', list(CHECKS))
+def test_deferred_matches_eager(db, name):
+    (eager_rows, deferred_rows), differences = run_check(db, name)
+    assert eager_rows > 0
+    assert eager_rows == deferred_rows
+    assert differences == []
+
+
+def test_address_skips_missing_lines(db):
+    company = db.raw_sql('select gvkey, add1, add2, add3, add4 from compa.company').set_index('gvkey')
+    expected = company.apply(lambda lines: '\n'.join(lines.dropna()) or None, axis=1)
+
+    # The address is computed on the server, or from the full company table if it is already held.
+    for download_full_table in [False, True]:
+        wrds = _connection(db)
+        wrds.build_sp500()
+        if download_full_table:
+            wrds._download_company_table()
+        wrds.add_address()
+        addresses = wrds.dataset.drop_duplicates('gvkey').set_index('gvkey')['address']
+        assert addresses.notna().any()
+        pd.testing.assert_series_equal(addresses, expected.reindex(addresses.index), check_names=False,
+                                       check_dtype=False)
+
+
+def test_store_separates_databases():
+    store = SharedTableStore()
+    small, large = FakeWrdsConnection(companies=50), FakeWrdsConnection(companies=100)
+    try:
+        for db in [small, large]:
+            wrds = _connection(db, table_store=store)
+            wrds._download_names_table()
+            assert len(wrds._names_table) == db.companies
+    finally:
+        small.close()
+        large.close()
+
+
+def test_store_isolates_connections(db):
+    store = SharedTableStore()
+    first, second = _connection(db, table_store=store), _connection(db, table_store=store)
+    first._download_names_table()
+    second._download_names_table()
+    name = second._names_table.loc[0, 'conm']
+    first._names_table.loc[0, 'conm'] = 'CHANGED'
+    assert second._names_table.loc[0, 'conm'] == name
+    assert _connection(db, table_store=store)._get_table('compa', 'names').loc[0, 'conm'] == name
+
+
+def test_cache_separates_compact_floats(db, tmp_path):
+    cache = TableCache(str(tmp_path))
+    compact = _connection(db, cache=cache, compact_floats=True)._get_table('execcomp', 'anncomp')
+    full = _connection(db, cache=cache, compact_floats=False)._get_table('execcomp', 'anncomp')
+    assert compact['salary'].dtype == 'float32'
+    assert full['salary'].dtype == 'float64'
+
+
+def test_build_samples_matches_connection(db):
+    pytest.importorskip('pyarrow')
+    steps = [('build_sp500', {}), ('add_names', {}), ('add_industry_classifiers', {'get_gics': True}),
+             ('add_executives', {}), ('add_address', {})]
+    specifications = [{'selection_start_date': date(year, 1, 1), 'selection_end_date': date(year + 4, 12, 31),
+                       'observation_start_date': date(year, 1, 1), 'observation_end_date': date(year + 4, 12, 31),
+                       'steps': steps} for year in [2000, 2005]]
+    samples = build_samples(_connection(db), specifications, max_workers=2)
+    for specification, sample in zip(specifications, samples):
+        wrds = _connection(db, **{key: value for key, value in specification.items() if key != 'steps'})
+        for method, arguments in steps:
+            getattr(wrds, method)(**arguments)
+        assert list(sample.columns) == list(wrds.dataset.columns)
+        assert sample['execid'].dtype == 'category'
+        pd.testing.assert_frame_equal(_normalized(sample, list(sample.columns)),
+                                      _normalized(wrds.dataset, list(sample.columns)))
@@ -1,2 +1,28 @@
-from wrds_tools.wrds_connection import WrdsConnection
-from wrds_tools.wrds_connection import print_setup_instructions
+import importlib
+
+# The modules are only imported when one of their names is first used, so that importing wrds_tools does not import
+# wrds, pandas and numpy.
+_exports = {'WrdsConnection': 'wrds_tools.wrds_connection',
+            'print_setup_instructions': 'wrds_tools.wrds_connection',
+            'TableCache': 'wrds_tools.table_cache',
+            'IndexMembership': 'wrds_tools.index_membership',
+            'Instrumentation': 'wrds_tools.instrumentation',
+            'SharedTableStore': 'wrds_tools.table_store',
+            'shared_table_store': 'wrds_tools.table_store',
+            'build_samples': 'wrds_tools.batch',
+            'load_dataset': 'wrds_tools.dataset_io',
+            'AsyncWrdsConnection': 'wrds_tools.async_connection'}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
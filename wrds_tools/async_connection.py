@@ -0,0 +1,133 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wrds_tools.wrds_connection import WrdsConnection
+
+
+def _async_method(name: str):
+    """
+    Builds the asynchronous counterpart of a method of WrdsConnection that works on the dataset. The method runs on the
+    executor, after the methods that were called on the connection before it have finished.
+    """
+    async def method(self, *args, **kwargs):
+        async with self._lock:
+            return await self._run(getattr(self.connection, name), *args, **kwargs)
+
+    method.__name__ = name
+    method.__qualname__ = 'AsyncWrdsConnection.' + name
+    method.__doc__ = 'Asynchronous version of WrdsConnection.{0}.\n{1}'.format(
+        name, getattr(WrdsConnection, name).__doc__ or '')
+    return method
+
+
+class AsyncWrdsConnection:
+    """
+    Asyncio interface to a WrdsConnection, for use in event loops (e.g., web services). All queries and pandas operations
+    run on a thread pool, so that they do not block the event loop. The methods that build the dataset run one after the
+    other, in the order in which they are called, as each of them works on the result of the previous one. Downloads
+    started with prefetch, and queries run with read_sql and stream_sql, run at the same time as these methods and as
+    each other, each on its own connection from the connection pool.
+    The connection to WRDS is opened on first use, so creating the object does not block.
+
+    :param args: Arguments of WrdsConnection.
+    :param executor: A concurrent.futures executor to run the operations on. Several connections can share an
+    executor. If not provided, each connection creates a thread pool of its own.
+    :param max_workers: Number of threads of the thread pool, if no executor is provided.
+    :param kwargs: Keyword arguments of WrdsConnection.
+    """
+    def __init__(self, *args, executor=None, max_workers=4, **kwargs):
+        self.connection = WrdsConnection(*args, **kwargs)
+        self._own_executor = executor is None
+        self._executor = executor if executor is not None else \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wrds_async')
+        self._lock = asyncio.Lock()
+
+    @property
+    def dataset(self):
+        return self.connection.dataset
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    build_sp500 = _async_method('build_sp500')
+    build_index_panel = _async_method('build_index_panel')
+    index_membership = _async_method('index_membership')
+    add_index_membership = _async_method('add_index_membership')
+    collect = _async_method('collect')
+    add_names_fields = _async_method('add_names_fields')
+    add_names = _async_method('add_names')
+    add_ticker = _async_method('add_ticker')
+    add_cusip = _async_method('add_cusip')
+    add_cik = _async_method('add_cik')
+    add_exit_year = _async_method('add_exit_year')
+    add_ipo_date = _async_method('add_ipo_date')
+    add_industry_classifiers = _async_method('add_industry_classifiers')
+    add_executives = _async_method('add_executives')
+    add_executive_info = _async_method('add_executive_info')
+    add_company_info = _async_method('add_company_info')
+    add_address = _async_method('add_address')
+    filter_by_industry = _async_method('filter_by_industry')
+    sync_table = _async_method('sync_table')
+    export_dataset = _async_method('export_dataset')
+
+    async def prefetch(self, tables: list = ('names', 'company', 'executives'), max_workers=4):
+        """
+        Downloads tables in the background (see WrdsConnection.prefetch) and waits until they are downloaded. Methods
+        that are called on the connection in the meantime are not held up: run prefetch as a task, and the methods
+        that need one of the tables wait only for that table.
+        :param tables: Tables to download: any of 'names', 'company', 'executives' and 'annuals'.
+        :param max_workers: Maximum number of downloads that run at the same time.
+        """
+        async with self._lock:
+            self.connection.prefetch(tables, max_workers=max_workers)
+            futures = [self.connection._prefetched[table] for table in tables if table in self.connection._prefetched]
+        await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
+
+    async def read_sql(self, sql: str, params: dict = None):
+        """
+        Runs a query on a connection from the connection pool.
+        :param sql: SQL query.
+        :param params: Query parameters.
+        :return: Pandas dataframe.
+        """
+        return await self._run(self.connection._read_sql, sql, params=params)
+
+    async def stream_sql(self, sql: str, params: dict = None, chunksize=100000):
+        """
+        Runs a query through a server-side cursor and yields the result in chunks. The next chunk is fetched while the
+        current one is processed.
+        :param sql: SQL query.
+        :param params: Query parameters.
+        :param chunksize: Number of rows per chunk.
+        :return: Asynchronous generator of dataframes.
+        """
+        chunks = self.connection._stream_sql(sql, params=params, chunksize=chunksize)
+        next_chunk = asyncio.ensure_future(self._run(next, chunks, None))
+        try:
+            while True:
+                chunk = await next_chunk
+                if chunk is None:
+                    break
+                next_chunk = asyncio.ensure_future(self._run(next, chunks, None))
+                yield chunk
+        finally:
+            # The generator can only be closed once the chunk that is being fetched has arrived.
+            await asyncio.gather(next_chunk, return_exceptions=True)
+            await self._run(chunks.close)
+
+    async def close(self):
+        """
+        Waits for the operations that are running, and shuts down the thread pool of the connection.
+        """
+        async with self._lock:
+            if self._own_executor:
+                await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from pandas.api.types import CategoricalDtype
+
+from wrds_tools.table_cache import TableCache
+from wrds_tools.table_store import SharedTableStore
+from wrds_tools.wrds_connection import WrdsConnection
+
+# Reference tables that can be shared with the workers, mapped to their library.
+REFERENCE_TABLES = {'idxcst_his': 'compa', 'names': 'compa', 'company': 'compa', 'anncomp': 'execcomp',
+                    'funda': 'compa'}
+# Settings of a sample specification that are passed to the connection of the worker.
+_PERIOD_SETTINGS = ['selection_start_date', 'selection_end_date', 'observation_start_date', 'observation_end_date']
+
+# The reference tables of a worker process, loaded once by _load_reference_tables.
+_worker_tables = {}
+_worker_settings = {}
+
+
+class _NoServer:
+    """
+    Stands in for the database connection of the workers, which only work with the reference tables.
+    """
+    @property
+    def engine(self):
+        raise RuntimeError('The samples of build_samples are built from the reference tables only, but a step tried to '
+                           'query the WRDS server. Add the table it needs to the reference tables.')
+
+
+def build_samples(wrds: WrdsConnection, specifications: list, tables: list = ('idxcst_his', 'names', 'company',
+                                                                              'anncomp'),
+                  annual_columns: list = None, max_workers: int = None, directory: str = None):
+    """
+    Builds many samples at once on a pool of processes. The reference tables are downloaded once, by the connection
+    that is passed in, and written to Arrow IPC files. The workers memory-map these files instead of receiving a copy
+    of every table. Only the columns that pyarrow converts to pandas without copying are read directly from the mapped
+    files, which the operating system keeps in memory once for all workers: numeric columns without missing values,
+    and string columns (as pandas 3 stores strings in Arrow arrays). With pandas 3, the categorical columns of the
+    downloaded tables (see dtypes.py) are therefore written as strings, and only converted back to categories in the
+    samples. Every worker converts the numeric columns with missing values into memory of its own, and, with pandas 2,
+    the string columns and the categorical columns, whose codes and categories are rebuilt. Each worker then builds
+    its samples with the same methods as a WrdsConnection, without querying the WRDS server.
+    Requires pyarrow.
+    :param wrds: Connection used to download the reference tables.
+    :param specifications: List of sample specifications. A specification is a dictionary that can set the periods of
+    the connection (selection_start_date, selection_end_date, observation_start_date and observation_end_date), and
+    lists the methods to run under "steps", as tuples of method name and keyword arguments, e.g.:
+    {'selection_start_date': date(2000, 1, 1), 'steps': [('build_sp500', {}),
+    ('filter_by_industry', {'industry_code': '3674', 'classification_system': 'SIC'}), ('add_executives', {})]}
+    :param tables: Reference tables to download: any of 'idxcst_his', 'names', 'company', 'anncomp' and 'funda'.
+    Steps that need a table that is not among the reference tables fail. Deferred mode and streaming (add_company_info
+    with stream=True) are not available, as they query the server.
+    :param annual_columns: Columns of the "FUNDA" table to download, if it is among the reference tables. Must include
+    gvkey and fyear. Downloading all columns of the table requires a lot of memory.
+    :param max_workers: Number of processes. Defaults to the number of processors.
+    :param directory: Directory for the Arrow IPC files. If not provided, a temporary directory is used and removed
+    afterwards.
+    :return: List with the dataset of each specification, in the order of the specifications.
+    """
+    unknown_tables = [table for table in tables if table not in REFERENCE_TABLES]
+    if unknown_tables:
+        raise ValueError('Unknown tables: {0}. Available tables: {1}.'.format(unknown_tables, list(REFERENCE_TABLES)))
+    pa = TableCache._import_pyarrow()
+
+    temporary = directory is None
+    directory = tempfile.mkdtemp(prefix='wrds_batch_') if temporary else directory
+    os.makedirs(directory, exist_ok=True)
+    try:
+        paths = {}
+        categorical_columns, other_columns = set(), set()
+        for table in tables:
+            df = wrds._get_table(library=REFERENCE_TABLES[table], table=table,
+                                 columns=annual_columns if table == 'funda' else None)
+            for column in df.columns:
+                (categorical_columns if isinstance(df[column].dtype, CategoricalDtype) else other_columns).add(column)
+            paths[table] = os.path.join(directory, table + '.arrow')
+            arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+            if _strings_in_arrow():
+                arrow_table = _decode_dictionaries(pa, arrow_table)
+            with pa.ipc.new_file(paths[table], arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+            del df, arrow_table
+
+        settings = {'username': wrds.username, 'compact_floats': wrds.compact_floats,
+                    'annual_columns': annual_columns, 'categorical_columns': categorical_columns - other_columns}
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_load_reference_tables,
+                                 initargs=(paths, settings)) as executor:
+            return list(executor.map(_build_sample, specifications))
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _strings_in_arrow():
+    """
+    :return: Whether pandas stores strings in Arrow arrays (the default from pandas 3), rather than as Python objects.
+    """
+    try:
+        return pd.get_option('future.infer_string') is True
+    except KeyError:
+        return False
+
+
+def _decode_dictionaries(pa, arrow_table):
+    """
+    Replaces the dictionary columns of a table (the categorical columns of the downloaded tables) by the values they
+    stand for. pyarrow rebuilds the codes and categories of a dictionary column in the memory of every worker that
+    converts it to pandas, while a column of strings is read from the mapped file without copying.
+    """
+    for index, field in enumerate(arrow_table.schema):
+        if pa.types.is_dictionary(field.type):
+            value_type = field.type.value_type
+            if pa.types.is_string(value_type) or pa.types.is_large_string(value_type):
+                # pandas stores strings in large_string arrays, so that the column does not have to be cast again.
+                value_type = pa.large_string()
+            arrow_table = arrow_table.set_column(index, field.with_type(value_type),
+                                                 arrow_table.column(index).cast(value_type))
+    return arrow_table
+
+
+def _load_reference_tables(paths: dict, settings: dict):
+    """
+    Memory-maps the reference tables in a worker process.
+    """
+    pa = TableCache._import_pyarrow()
+    for table, path in paths.items():
+        # split_blocks keeps every column in a block of its own, so that the columns that are read from the mapped file
+        # are not copied into blocks that hold several columns.
+        _worker_tables[table] = pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas(split_blocks=True)
+    _worker_settings.update(settings)
+
+
+def _build_sample(specification: dict):
+    """
+    Builds the sample of a specification in a worker process.
+    :return: The dataset.
+    """
+    unknown_settings = [key for key in specification if key not in _PERIOD_SETTINGS + ['steps']]
+    if unknown_settings:
+        raise ValueError('Unknown settings: {0}. Available settings: {1}.'.format(unknown_settings,
+                                                                                  _PERIOD_SETTINGS + ['steps']))
+    wrds = WrdsConnection(_worker_settings['username'], compact_floats=_worker_settings['compact_floats'],
+                          db=_NoServer(), table_store=SharedTableStore(),
+                          **{key: specification[key] for key in _PERIOD_SETTINGS if key in specification})
+    wrds._constituents_table = _worker_tables.get('idxcst_his')
+    wrds._names_table = _worker_tables.get('names')
+    wrds._company_table = _worker_tables.get('company')
+    if 'anncomp' in _worker_tables:
+        wrds._executive_table, wrds._executive_scope = _worker_tables['anncomp'], (None, (None, None), None)
+    if 'funda' in _worker_tables:
+        annual_columns = _worker_settings['annual_columns']
+        wrds._annuals_table = _worker_tables['funda']
+        wrds._annuals_scope = (None, (None, None), set(annual_columns) if annual_columns is not None else None)
+
+    for method, arguments in specification.get('steps', []):
+        getattr(wrds, method)(**arguments)
+    # The reference tables can hold their categorical columns as strings (see _decode_dictionaries). The columns that
+    # are categorical in every table they come from are converted back, so that a sample has the same types as the
+    # sample of a WrdsConnection. The dataset is small compared to the reference tables.
+    for column in wrds.dataset.columns if wrds.dataset is not None else []:
+        if column in _worker_settings['categorical_columns'] and \
+                not isinstance(wrds.dataset[column].dtype, CategoricalDtype):
+            wrds.dataset[column] = wrds.dataset[column].astype('category')
+    return wrds.dataset
@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from pandas import DataFrame
+
+from wrds_tools.table_cache import TableCache
+
+# Name of the partition of rows without a year, as used by Hive and read back as a missing year by pyarrow.
+_MISSING_YEAR_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def write_dataset(df: DataFrame, path: str, file_format='parquet', partition_by_year=True, row_group_size=100000,
+                  overwrite=False):
+    """
+    Writes a dataset to disk, in row groups of row_group_size rows. Only one row group is converted to the Arrow format
+    at a time, so that writing does not need a second copy of the full dataset in memory.
+    :param df: The dataset.
+    :param path: Directory (Parquet) or file (Feather) to write to.
+    :param file_format: 'parquet' or 'feather'. Feather files are written uncompressed, so that they can be
+    memory-mapped by load_dataset.
+    :param partition_by_year: Write Parquet datasets with a year column as one directory per year ("year=2001"), so
+    that load_dataset only reads the years that are requested.
+    :param row_group_size: Number of rows per row group (Parquet) or record batch (Feather).
+    :param overwrite: Replace existing output. Otherwise, existing output raises an error.
+    """
+    if file_format not in ['parquet', 'feather']:
+        raise ValueError('Unknown format: {0}. Available formats: parquet, feather.'.format(file_format))
+    pa = TableCache._import_pyarrow()
+    if os.path.exists(path):
+        if not overwrite:
+            raise FileExistsError('{0} already exists. Set overwrite to replace it.'.format(path))
+        shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    # The schema is inferred from the full dataset once. Inferred from a single row group, columns that are missing
+    # in all of its rows would get another type than in the other row groups.
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+
+    if file_format == 'feather':
+        with pa.ipc.new_file(path, schema) as writer:
+            for start in range(0, len(df), row_group_size):
+                writer.write_table(pa.Table.from_pandas(df.iloc[start:start + row_group_size], schema=schema,
+                                                        preserve_index=False))
+        return
+
+    os.makedirs(path)
+    if not (partition_by_year and 'year' in df.columns):
+        _write_parquet_file(df, np.arange(len(df)), np.arange(df.shape[1]), os.path.join(path, 'part-0.parquet'),
+                            schema, row_group_size)
+        return
+
+    # The year is stored in the directory names, not in the files.
+    schema = schema.remove(schema.get_field_index('year'))
+    columns = np.flatnonzero(df.columns != 'year')
+    years = pd.to_numeric(df['year'], errors='coerce').astype('Int64')
+    for year in years.dropna().unique().tolist() + ([None] if years.isna().any() else []):
+        rows = np.flatnonzero(years.isna().to_numpy() if year is None else (years == year).fillna(False).to_numpy())
+        directory = os.path.join(path, 'year={0}'.format(_MISSING_YEAR_PARTITION if year is None else year))
+        os.makedirs(directory)
+        _write_parquet_file(df, rows, columns, os.path.join(directory, 'part-0.parquet'), schema, row_group_size)
+
+
+def _write_parquet_file(df: DataFrame, rows: np.ndarray, columns: np.ndarray, path: str, schema, row_group_size: int):
+    """
+    Writes the given rows and columns (by position) of a dataset to a Parquet file, one row group at a time.
+    """
+    pa, pq = TableCache._import_pyarrow(), TableCache._import_parquet()
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, len(rows), row_group_size):
+            writer.write_table(pa.Table.from_pandas(df.iloc[rows[start:start + row_group_size], columns],
+                                                    schema=schema, preserve_index=False))
+
+
+def load_dataset(path: str, columns: list = None, years: tuple = None):
+    """
+    Loads a dataset written by WrdsConnection.export_dataset. Only the requested columns and years are read: Parquet
+    datasets that are partitioned by year only open the directories of the requested years, and Feather files are
+    memory-mapped, so that only the parts that are needed are read from disk.
+    :param path: Directory (Parquet) or file (Feather) that the dataset was written to.
+    :param columns: Columns to load. If not provided, all columns are loaded.
+    :param years: Tuple with the first and last year to load. Either may be None. Requires a year column.
+    :return: Pandas dataframe.
+    """
+    TableCache._import_pyarrow()
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+
+    if os.path.isdir(path):
+        dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    else:
+        dataset = ds.dataset(path, format='feather', filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+
+    condition = None
+    first_year, last_year = years if years is not None else (None, None)
+    if first_year is not None:
+        condition = ds.field('year') >= first_year
+    if last_year is not None:
+        condition = ds.field('year') <= last_year if condition is None else condition & (ds.field('year') <= last_year)
+    df = dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+    # The year of partitioned datasets is read after the other columns, and is moved back to its place.
+    if columns is None and dataset.schema.metadata is not None and b'pandas' in dataset.schema.metadata:
+        order = [column['name'] for column in json.loads(dataset.schema.metadata[b'pandas'])['columns']]
+        df = df[[column for column in order if column in df.columns] +
+                [column for column in df.columns if column not in order]]
+    return df
@@ -0,0 +1,54 @@
+import os
+import shutil
+
+from pandas import DataFrame
+
+from wrds_tools.table_cache import TableCache
+
+
+class DownloadCheckpoints:
+    """
+    Stores the parts of a large table download on disk, so that a download that is interrupted (e.g., by a dropped
+    connection) resumes with the first part that was not finished, instead of starting over. The parts of a download
+    are kept in a directory of their own, keyed like the tables in a TableCache, and are removed once the download is
+    assembled. Requires pyarrow.
+
+    :param directory: Directory in which the parts are stored. Created if it does not exist.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def load(self, library: str, table: str, part: str, columns: list = None, filters: dict = None):
+        """
+        :param part: Name of the part, e.g., the range of years it holds.
+        :return: A finished part of a download as a Pandas DataFrame, or None if the part has not been downloaded.
+        """
+        path = self._part_path(library, table, part, columns, filters)
+        if not os.path.exists(path):
+            return None
+        return TableCache._import_parquet().read_table(path).to_pandas()
+
+    def save(self, df: DataFrame, library: str, table: str, part: str, columns: list = None, filters: dict = None):
+        """
+        Stores a finished part of a download.
+        """
+        pa, pq = TableCache._import_pyarrow(), TableCache._import_parquet()
+        path = self._part_path(library, table, part, columns, filters)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # As in the table cache, a part is only stored under its name once it has been written completely, and every
+        # writer uses a temporary file of its own.
+        TableCache._write_atomically(path, lambda temporary_path: pq.write_table(
+            pa.Table.from_pandas(df, preserve_index=False), temporary_path))
+
+    def clear(self, library: str, table: str, columns: list = None, filters: dict = None):
+        """
+        Removes the parts of a download.
+        """
+        shutil.rmtree(self._download_directory(library, table, columns, filters), ignore_errors=True)
+
+    def _download_directory(self, library: str, table: str, columns: list = None, filters: dict = None):
+        return os.path.join(self.directory, TableCache.key(library, table, columns, filters))
+
+    def _part_path(self, library: str, table: str, part: str, columns: list = None, filters: dict = None):
+        return os.path.join(self._download_directory(library, table, columns, filters), part + '.parquet')
@@ -0,0 +1,77 @@
+import pandas as pd
+
+from pandas import DataFrame
+from pandas.api.types import CategoricalDtype
+
+
+# Compact data types for the columns of the WRDS tables, applied as soon as a table (or a chunk of it) is downloaded.
+# Identifiers and industry codes that repeat across rows are stored as categories, years and months as nullable small
+# integers. Identifiers that are unique in a table (e.g., gvkey in NAMES) stay strings, as a category would not save
+# memory there.
+TABLE_DTYPES = {
+    'idxcst_his': {'gvkeyx': 'category', 'iid': 'category'},
+    'names': {'sic': 'category', 'naics': 'category', 'year1': 'Int16', 'year2': 'Int16'},
+    'company': {'sic': 'category', 'naics': 'category', 'ggroup': 'category', 'gind': 'category',
+                'gsector': 'category', 'gsubind': 'category', 'spcindcd': 'category', 'spcseccd': 'category',
+                'spcsrc': 'category', 'state': 'category', 'fic': 'category', 'loc': 'category',
+                'costat': 'category', 'stko': 'category', 'idbflag': 'category', 'incorp': 'category'},
+    'anncomp': {'gvkey': 'category', 'execid': 'category', 'co_per_rol': 'category', 'ceoann': 'category',
+                'titleann': 'category', 'cfoann': 'category', 'exec_fullname': 'category', 'tic': 'category',
+                'cusip': 'category', 'sic': 'category', 'naics': 'category', 'year': 'Int16'},
+    'funda': {'gvkey': 'category', 'tic': 'category', 'cusip': 'category', 'conm': 'category', 'cik': 'category',
+              'indfmt': 'category', 'consol': 'category', 'popsrc': 'category', 'datafmt': 'category',
+              'curcd': 'category', 'costat': 'category', 'fyear': 'Int16', 'fyr': 'Int8', 'fyrc': 'Int8'},
+}
+
+# Tables with financial items, which can be stored as 32-bit floats on request.
+FINANCIAL_TABLES = ['anncomp', 'funda']
+
+
+def apply_dtypes(df: DataFrame, table: str, compact_floats=False):
+    """
+    Converts the columns of a downloaded table to the compact data types in TABLE_DTYPES. Columns that are not in the
+    table are skipped.
+    :param df: The downloaded table, or a chunk of it. Converted in place.
+    :param table: Name of the table on the WRDS server, e.g., 'funda'.
+    :param compact_floats: Also store the remaining 64-bit float columns of tables with financial items as 32-bit
+    floats. Halves their memory use, at a precision of about seven significant digits.
+    :return: The converted dataframe.
+    """
+    for column, dtype in TABLE_DTYPES.get(table, {}).items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        if dtype.startswith('Int'):
+            # Years and months arrive as floats, as they contain missing values.
+            df[column] = pd.to_numeric(df[column], errors='coerce').round().astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+
+    if compact_floats and table in FINANCIAL_TABLES:
+        float_columns = [column for column in df.columns if df[column].dtype == 'float64']
+        df[float_columns] = df[float_columns].astype('float32')
+    return df
+
+
+def concat_tables(frames: list):
+    """
+    Concatenates chunks of a table. Categorical columns stay categorical: pd.concat would turn them into object columns
+    if the chunks have different categories, so the categories of all chunks are combined first.
+    :param frames: List of dataframes with the same columns.
+    :return: The concatenated dataframe.
+    """
+    frames = list(frames)
+    for column in frames[0].columns:
+        if all(isinstance(frame[column].dtype, CategoricalDtype) for frame in frames):
+            categories = frames[0][column].cat.categories
+            for frame in frames[1:]:
+                categories = categories.union(frame[column].cat.categories)
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def memory_usage(df: DataFrame):
+    """
+    :return: Memory used by a dataframe, in bytes, including the contents of string columns.
+    """
+    return int(df.memory_usage(deep=True).sum())
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+from pandas import DataFrame
+
+
+class IndexMembership:
+    """
+    Point-in-time index membership, built from the constituent history in the "IDXCST_HIS" table in compustat's "COMPA"
+    library. Every spell of a company in an index is stored as an interval of days. The intervals are sorted by index,
+    company and start date, so that membership can be looked up for millions of (gvkey, date) pairs at once with a
+    binary search (numpy.searchsorted), instead of row by row.
+    Companies that left an index and joined again later have one interval per spell. Overlapping or adjacent spells are
+    combined.
+
+    :param constituents: Pandas dataframe with the columns gvkeyx, gvkey, from and thru, as in the "IDXCST_HIS" table.
+    A missing thru date means that the company is still in the index.
+    """
+    # Days are stored relative to this offset, and the (index, company) code is stored in the bits above, so that one
+    # sorted array of int64 keys orders the intervals by index, company and start date.
+    _day_offset = 2 ** 20
+    _code_shift = 2 ** 21
+    # End day of spells that are still ongoing.
+    _ongoing = 2 ** 21 - 1
+
+    def __init__(self, constituents: DataFrame):
+        # The (index, company) pairs. Level 0 holds the index key, level 1 the gvkey.
+        pairs = pd.MultiIndex.from_arrays([constituents['gvkeyx'].astype(str), constituents['gvkey'].astype(str)])
+        codes, self._pairs = pairs.factorize()
+        starts = self._to_days(constituents['from'])
+        ends = self._to_days(constituents['thru'], missing=self._ongoing)
+
+        order = np.lexsort((starts, codes))
+        codes, starts, ends = codes[order], starts[order], ends[order]
+
+        # An interval starts a new spell if it belongs to another (index, company) pair than the previous interval, or
+        # if it starts after all previous intervals of the pair have ended.
+        running_ends = pd.Series(ends).groupby(codes).cummax().to_numpy()
+        new_spell = np.ones(len(codes), dtype=bool)
+        new_spell[1:] = (codes[1:] != codes[:-1]) | (starts[1:] > running_ends[:-1] + 1)
+        spell_starts = np.flatnonzero(new_spell)
+
+        self._codes = codes[spell_starts]
+        self._starts = starts[spell_starts]
+        self._ends = np.maximum.reduceat(ends, spell_starts) if len(spell_starts) else ends
+        self._keys = self._codes.astype(np.int64) * self._code_shift + self._starts
+
+    def intervals(self):
+        """
+        :return: Pandas dataframe with one row per spell of a company in an index (gvkeyx, gvkey, from, thru). Ongoing
+        spells have no thru date.
+        """
+        pairs = self._pairs[self._codes]
+        thru = self._from_days(self._ends)
+        thru[self._ends == self._ongoing] = np.datetime64('NaT')
+        return DataFrame({'gvkeyx': pairs.get_level_values(0), 'gvkey': pairs.get_level_values(1),
+                          'from': self._from_days(self._starts), 'thru': thru})
+
+    def is_member(self, gvkeys, dates, index_key='000003'):
+        """
+        Checks whether companies were in an index on given days.
+        :param gvkeys: Array-like of gvkeys.
+        :param dates: Array-like of dates, of the same length as gvkeys.
+        :param index_key: Global Index Key (gvkeyx) of the index, or an array-like of index keys of the same length as
+        gvkeys. Defaults to "000003", the key of the S&P 500.
+        :return: Boolean numpy array.
+        """
+        days = self._to_days(dates)
+        return self._member_during(gvkeys, days, days, index_key)
+
+    def is_member_during(self, gvkeys, start_dates, end_dates, index_key='000003'):
+        """
+        Checks whether companies were in an index at any time within given periods.
+        :param gvkeys: Array-like of gvkeys.
+        :param start_dates: Array-like of first days of the periods, of the same length as gvkeys.
+        :param end_dates: Array-like of last days of the periods, of the same length as gvkeys.
+        :param index_key: Global Index Key (gvkeyx) of the index, or an array-like of index keys of the same length as
+        gvkeys.
+        :return: Boolean numpy array.
+        """
+        return self._member_during(gvkeys, self._to_days(start_dates), self._to_days(end_dates), index_key)
+
+    def is_member_in_year(self, gvkeys, years, index_key='000003'):
+        """
+        Checks whether companies were in an index at any time within given years.
+        :param gvkeys: Array-like of gvkeys.
+        :param years: Array-like of years, of the same length as gvkeys.
+        :param index_key: Global Index Key (gvkeyx) of the index, or an array-like of index keys of the same length as
+        gvkeys.
+        :return: Boolean numpy array.
+        """
+        years = pd.to_numeric(pd.Series(years), errors='coerce').astype('Int64').astype(str)
+        start_dates = pd.to_datetime(years + '-01-01', errors='coerce')
+        end_dates = pd.to_datetime(years + '-12-31', errors='coerce')
+        return self.is_member_during(gvkeys, start_dates, end_dates, index_key)
+
+    def firm_years(self, start_year: int, end_year: int, index_key='000003'):
+        """
+        Expands the constituent history into a panel of the company-years in which the companies were in an index at
+        any time.
+        :param start_year: First year of the panel.
+        :param end_year: Last year of the panel.
+        :param index_key: Global Index Key (gvkeyx) of the index, or a list of index keys.
+        :return: Pandas dataframe with the columns gvkey and year (and gvkeyx, if several index keys are provided),
+        sorted by gvkey and year.
+        """
+        index_keys = [index_key] if isinstance(index_key, str) else list(index_key)
+        pairs = self._pairs[self._codes]
+        selected = np.asarray(pairs.get_level_values(0).isin(index_keys), dtype=bool)
+
+        first_years = np.maximum(self._from_days(self._starts[selected]).astype('datetime64[Y]').astype(int) + 1970,
+                                 start_year)
+        last_years = np.minimum(self._from_days(self._ends[selected]).astype('datetime64[Y]').astype(int) + 1970,
+                                end_year)
+        counts = np.clip(last_years - first_years + 1, 0, None)
+
+        # One row per spell and year: the first year of each spell is repeated and the offset within the spell added.
+        spell_rows = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        panel = DataFrame({'gvkeyx': pairs.get_level_values(0)[selected][spell_rows],
+                           'gvkey': pairs.get_level_values(1)[selected][spell_rows],
+                           'year': first_years[spell_rows] + offsets})
+
+        # Companies that left an index and joined again in the same year would otherwise appear twice.
+        panel = panel.drop_duplicates().sort_values(['gvkey', 'year', 'gvkeyx'], ignore_index=True)
+        if len(index_keys) == 1:
+            panel = panel.drop(columns='gvkeyx')
+        return panel
+
+    def _member_during(self, gvkeys, start_days: np.ndarray, end_days: np.ndarray, index_key):
+        gvkeys = pd.Index(gvkeys).astype(str)
+        index_keys = pd.Index([index_key] * len(gvkeys) if isinstance(index_key, str) else index_key).astype(str)
+        codes = self._pairs.get_indexer(pd.MultiIndex.from_arrays([index_keys, gvkeys]))
+
+        if not len(self._keys):
+            return np.zeros(len(gvkeys), dtype=bool)
+
+        # The last spell of the company that started on or before the end of the period. As the spells of a company do
+        # not overlap, this is the only spell that can still be ongoing at the start of the period.
+        positions = np.searchsorted(self._keys, codes.astype(np.int64) * self._code_shift + end_days, side='right') - 1
+        found = np.clip(positions, 0, None)
+        # Unknown companies (code -1) and missing dates (day 0) are never members.
+        return ((codes >= 0) & (positions >= 0) & (start_days > 0) & (start_days <= end_days) &
+                (self._codes[found] == codes) & (self._ends[found] >= start_days))
+
+    @classmethod
+    def _to_days(cls, dates, missing=0):
+        """
+        Converts dates to offset day numbers. Missing dates are set to missing.
+        """
+        dates = pd.to_datetime(pd.Series(dates), errors='coerce')
+        days = dates.to_numpy(dtype='datetime64[D]').astype(np.int64) + cls._day_offset
+        days[dates.isna().to_numpy()] = missing
+        return days
+
+    @classmethod
+    def _from_days(cls, days):
+        return (np.asarray(days) - cls._day_offset).astype('datetime64[D]')
@@ -0,0 +1,173 @@
+import functools
+import json
+import threading
+import time
+
+from datetime import datetime
+from pandas import DataFrame
+
+from wrds_tools.dtypes import memory_usage
+
+
+class Instrumentation:
+    """
+    Records the operations of a WrdsConnection: the public methods, and the helpers that download tables. Every call is
+    recorded as a dictionary with the following keys:
+    operation: Name of the method.
+    parent: Name of the operation that called the method, or None.
+    depth: Number of operations that were running when the method was called (on the same thread).
+    started: Time the operation started, as an ISO formatted string.
+    seconds: Wall time of the operation, including the operations it called.
+    rows_in, rows_out: Rows of the dataset before and after the operation (None if there was no dataset).
+    result_rows: Rows of the returned table, for helpers that return one.
+    dataset_bytes_delta: Change of the memory used by the dataset (only if track_memory is set, and only for public
+    methods that were not called by another operation).
+    queries: SQL queries run by the operation and the operations it called.
+    bytes_transferred: Memory used by the query results, as an estimate of the data downloaded.
+    error: Description of the exception raised by the operation, or None.
+
+    :param callbacks: Functions that are called with every record when an operation finishes, e.g., to send the records
+    to a monitoring service.
+    :param track_memory: Measure the memory used by the dataset before and after every public method that is called
+    directly (at depth 0). Requires a pass over all string columns of the dataset, which takes time for large datasets,
+    so it is not repeated for the operations that a method calls. Helpers that run on background threads (e.g., the
+    downloads of prefetch) are not measured either, as the dataset may be changed while they run.
+    """
+    def __init__(self, callbacks: list = None, track_memory=True):
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.track_memory = track_memory
+        self.records = []
+        self._lock = threading.Lock()
+        # The operations that are running, per thread.
+        self._local = threading.local()
+
+    def add_callback(self, callback):
+        """
+        Adds a function that is called with every record when an operation finishes.
+        """
+        self.callbacks.append(callback)
+
+    def start(self, operation: str, dataset):
+        """
+        Starts recording an operation.
+        :return: The record of the operation.
+        """
+        stack = self._stack()
+        record = {'operation': operation, 'parent': stack[-1][0]['operation'] if stack else None, 'depth': len(stack),
+                  'started': datetime.now().isoformat(), 'seconds': None, 'rows_in': self._rows(dataset),
+                  'rows_out': None, 'result_rows': None, 'dataset_bytes_delta': None, 'queries': [],
+                  'bytes_transferred': 0, 'error': None}
+        # The start time and the memory used by the dataset are kept on the stack, as they are not part of the output.
+        measure = self.track_memory and not stack and not operation.startswith('_')
+        stack.append((record, time.perf_counter(), self._bytes(dataset) if measure else None))
+        return record
+
+    def finish(self, record: dict, dataset, result=None, error: BaseException = None):
+        """
+        Finishes recording an operation, stores the record and passes it to the callbacks.
+        """
+        _, started, bytes_before = self._stack().pop()
+        record['seconds'] = time.perf_counter() - started
+        record['rows_out'] = self._rows(dataset)
+        record['result_rows'] = len(result) if isinstance(result, DataFrame) else None
+        bytes_after = self._bytes(dataset) if bytes_before is not None else None
+        if bytes_after is not None:
+            record['dataset_bytes_delta'] = bytes_after - bytes_before
+        if error is not None:
+            record['error'] = '{0}: {1}'.format(type(error).__name__, error)
+
+        with self._lock:
+            self.records.append(record)
+        for callback in self.callbacks:
+            callback(record)
+
+    def record_query(self, sql: str, result: DataFrame = None):
+        """
+        Records a query, and the size of its result, for all operations that are running on the current thread.
+        :param sql: The query, or None to only record the size of another part of the result of a query.
+        :param result: The result of the query.
+        """
+        transferred = memory_usage(result) if isinstance(result, DataFrame) else 0
+        for record, _, _ in self._stack():
+            if sql is not None:
+                record['queries'].append(sql)
+            record['bytes_transferred'] += transferred
+
+    def trace(self):
+        """
+        :return: Pandas dataframe with one row per recorded operation, in the order in which they finished.
+        """
+        with self._lock:
+            records = list(self.records)
+        return DataFrame(records, columns=['operation', 'parent', 'depth', 'started', 'seconds', 'rows_in', 'rows_out',
+                                           'result_rows', 'dataset_bytes_delta', 'queries', 'bytes_transferred',
+                                           'error'])
+
+    def summary(self):
+        """
+        Summarizes the recorded operations by method. Times, queries and transfers include those of the operations
+        that a method called, so they add up to more than the total across methods.
+        :return: Pandas dataframe indexed by operation, with the number of calls, total, mean and maximum seconds,
+        number of queries, bytes transferred and change of the memory used by the dataset. Sorted by total seconds.
+        """
+        trace = self.trace()
+        trace['query_count'] = trace['queries'].map(len)
+        summary = trace.groupby('operation').agg(calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                                 mean_seconds=('seconds', 'mean'), max_seconds=('seconds', 'max'),
+                                                 queries=('query_count', 'sum'),
+                                                 bytes_transferred=('bytes_transferred', 'sum'),
+                                                 dataset_bytes_delta=('dataset_bytes_delta', 'sum'))
+        return summary.sort_values('seconds', ascending=False)
+
+    def export(self, path: str):
+        """
+        Writes the records to a file in the JSON lines format, one record per line.
+        """
+        with self._lock:
+            records = list(self.records)
+        with open(path, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record, default=str) + '\n')
+
+    def clear(self):
+        """
+        Removes all records.
+        """
+        with self._lock:
+            self.records = []
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @staticmethod
+    def _rows(dataset):
+        return len(dataset) if isinstance(dataset, DataFrame) else None
+
+    def _bytes(self, dataset):
+        if not self.track_memory or not isinstance(dataset, DataFrame):
+            return None
+        return memory_usage(dataset)
+
+
+def instrumented(method):
+    """
+    Decorator for methods of WrdsConnection that records every call in the instrumentation of the connection, if one is
+    attached.
+    """
+    @functools.wraps(method)
+    def wrapper(connection, *args, **kwargs):
+        instrumentation = connection.instrumentation
+        if instrumentation is None:
+            return method(connection, *args, **kwargs)
+
+        record = instrumentation.start(method.__name__, connection.dataset)
+        try:
+            result = method(connection, *args, **kwargs)
+        except BaseException as error:
+            instrumentation.finish(record, connection.dataset, error=error)
+            raise
+        instrumentation.finish(record, connection.dataset, result=result)
+        return result
+    return wrapper
@@ -0,0 +1,174 @@
+class QueryPlan:
+    """
+    Records the sample and the columns requested from the WRDS tables while a WrdsConnection is in deferred mode, and
+    compiles them into a single SQL query. The names and company tables are joined on the gvkey, the executive and
+    annual tables on the gvkey and year, so the server only returns rows that belong to the sample.
+    """
+    def __init__(self):
+        self.sample_sql = None
+        self.params = {}
+        # Output column name -> SQL expression. The aliases of the joined tables are n (names), c (company),
+        # e (execcomp.anncomp), and f (compa.funda).
+        self.names_columns = {}
+        self.company_columns = {}
+        self.executive_columns = {}
+        self.annuals_columns = {}
+        self.conditions = []
+        # The table that was added first to provide a year column. The other yearly table is joined on that year.
+        self.year_source = None
+        self.ceo_only = False
+        self.executive_years = (None, None)
+        self.annual_years = (None, None)
+
+    def set_sample(self, sql: str, params: dict):
+        """
+        Sets the query that selects the sample. All other tables are joined to the result of this query.
+        :param sql: SQL query returning a gvkey column, and optionally other columns.
+        :param params: Query parameters.
+        """
+        self.sample_sql = sql
+        self.params.update(params)
+
+    def has_sample(self):
+        return self.sample_sql is not None
+
+    def add_columns(self, table: str, columns: dict):
+        """
+        Adds columns from one of the joined tables.
+        :param table: One of 'names', 'company', 'executives' and 'annuals'.
+        :param columns: Dictionary mapping names of output columns to SQL expressions on the source table.
+        """
+        target = {'names': self.names_columns, 'company': self.company_columns,
+                  'executives': self.executive_columns, 'annuals': self.annuals_columns}[table]
+        target.update(columns)
+
+    def has_columns(self, *columns):
+        all_columns = {**self.names_columns, **self.company_columns, **self.executive_columns, **self.annuals_columns}
+        return all(column in all_columns for column in columns)
+
+    def add_executives(self, ceo_only: bool, years: tuple):
+        """
+        Joins the executives (execid and year) from the "ANNCOMP" table.
+        :param ceo_only: Only join CEOs.
+        :param years: Tuple with first and last year of the observation period. Either may be None.
+        """
+        self.ceo_only = ceo_only
+        self.executive_years = years
+        self.add_columns('executives', {'execid': 'e.execid'})
+        if self.year_source is None:
+            self.year_source = 'executives'
+
+    def add_annuals(self, years: tuple):
+        """
+        Joins the "FUNDA" table.
+        :param years: Tuple with first and last fiscal year of the observation period. Either may be None.
+        """
+        self.annual_years = years
+        if self.year_source is None:
+            self.year_source = 'annuals'
+
+    def add_condition(self, condition: str, params: dict):
+        """
+        Adds a condition (on the output of the joins) that rows need to meet to be kept in the dataset.
+        :param condition: SQL condition, with parameters in the psycopg2 style, e.g., "n.sic in %(industry_codes)s".
+        :param params: Parameters of the condition. They are renamed with the number of the condition, so that the
+        parameters of conditions that use the same names do not replace each other.
+        """
+        suffix = '_{0}'.format(len(self.conditions))
+        for name in params:
+            condition = condition.replace('%({0})s'.format(name), '%({0}{1})s'.format(name, suffix))
+        self.conditions.append(condition)
+        self.params.update({name + suffix: value for name, value in params.items()})
+
+    def sql(self):
+        """
+        Compiles the plan.
+        :return: Tuple with the SQL query and the query parameters.
+        """
+        select = ['sample.*']
+        joins = []
+        for columns in [self.names_columns, self.company_columns, self.executive_columns, self.annuals_columns]:
+            select += ['{expression} as "{name}"'.format(expression=expression, name=name)
+                       for name, expression in columns.items()]
+
+        if self.names_columns:
+            joins.append('left join compa.names as n on n.gvkey = sample.gvkey')
+        if self.company_columns:
+            joins.append('left join compa.company as c on c.gvkey = sample.gvkey')
+
+        year_expression = None
+        if self.year_source == 'executives':
+            year_expression = 'e.year'
+        elif self.year_source == 'annuals':
+            year_expression = 'f.fyear'
+        if year_expression is not None:
+            select.append('{0} as "year"'.format(year_expression))
+
+        if self.year_source is not None:
+            joins += self._yearly_joins()
+
+        sql = 'with sample as ({sample}) select {select} from sample {joins}'.format(
+            sample=self.sample_sql, select=', '.join(select), joins=' '.join(joins))
+        if self.conditions:
+            sql += ' where ' + ' and '.join(self.conditions)
+        sql += ' order by sample.gvkey'
+        if year_expression is not None:
+            sql += ', ' + year_expression
+        return sql, self.params
+
+    def _yearly_joins(self):
+        """
+        Builds the joins of the executive and annual tables. The table that provides the year is joined on the gvkey,
+        restricted to the observation period. The other one is joined on the gvkey and that year.
+        """
+        joins = []
+        executives = bool(self.executive_columns)
+        annuals = self.year_source == 'annuals' or bool(self.annuals_columns)
+
+        if executives:
+            conditions = self._year_conditions('year', self.executive_years, 'executive')
+            if self.ceo_only:
+                conditions.append("ceoann = 'CEO'")
+            source_columns = sorted({'gvkey', 'year', 'execid', 'ceoann'} |
+                                    {expression[2:] for expression in self.executive_columns.values()
+                                     if expression.startswith('e.')})
+            subquery = 'select {columns} from execcomp.anncomp'.format(columns=', '.join(source_columns))
+            if conditions:
+                subquery += ' where ' + ' and '.join(conditions)
+            on = 'e.gvkey = sample.gvkey'
+            if self.year_source == 'annuals':
+                on += ' and e.year = f.fyear'
+            joins.append('left join ({subquery}) as e on {on}'.format(subquery=subquery, on=on))
+
+        if annuals:
+            conditions = self._year_conditions('fyear', self.annual_years, 'annual')
+            source_columns = sorted({'gvkey', 'fyear'} |
+                                    {expression[2:] for expression in self.annuals_columns.values()
+                                     if expression.startswith('f.')})
+            # For some reason, the FUNDA table has some duplicate rows with mostly nan values. Only one row per
+            # company-year is kept.
+            subquery = ('select * from (select {columns}, '
+                        'row_number() over (partition by gvkey, fyear) as duplicate_rank '
+                        'from compa.funda{where}) as annuals where duplicate_rank = 1').format(
+                columns=', '.join(source_columns), where=' where ' + ' and '.join(conditions) if conditions else '')
+            on = 'f.gvkey = sample.gvkey'
+            if self.year_source == 'executives':
+                on += ' and f.fyear = e.year'
+            join = 'left join ({subquery}) as f on {on}'.format(subquery=subquery, on=on)
+            # The join on the year needs the table providing the year to be joined first.
+            if self.year_source == 'annuals':
+                joins.insert(0, join)
+            else:
+                joins.append(join)
+        return joins
+
+    def _year_conditions(self, column: str, years: tuple, prefix: str):
+        conditions = []
+        first_year, last_year = years
+        if first_year is not None:
+            conditions.append('{column} >= %({prefix}_first_year)s'.format(column=column, prefix=prefix))
+            self.params['{0}_first_year'.format(prefix)] = first_year
+        if last_year is not None:
+            conditions.append('{column} <= %({prefix}_last_year)s'.format(column=column, prefix=prefix))
+            self.params['{0}_last_year'.format(prefix)] = last_year
+        return conditions
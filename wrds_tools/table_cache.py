@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from datetime import datetime, timedelta
+from pandas import DataFrame
+
+
+class TableCache:
+    """
+    A persistent, on-disk cache for tables downloaded from WRDS. Tables are stored as Parquet files, so that they can be
+    reused by other WrdsConnection objects and other processes. Each entry is keyed by library, table, the set of
+    downloaded columns and the filter that was applied on the server. Requires pyarrow.
+
+    :param directory: Directory in which the cached tables are stored. Created if it does not exist.
+    :param ttl: datetime.timedelta, maximum age of a cached table. Older tables are downloaded again. If no ttl is
+    provided, cached tables never expire.
+    :param max_bytes: Maximum size of the cache on disk. When the cache grows beyond this size, the tables that were
+    used least recently are removed. If not provided, the size of the cache is not bounded.
+    """
+    def __init__(self, directory: str, ttl: timedelta = None, max_bytes: int = None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(library: str, table: str, columns: list = None, filters: dict = None):
+        """
+        Builds the key under which a table is stored.
+        :param library: Name of the library (schema) on the WRDS server.
+        :param table: Name of the table.
+        :param columns: Downloaded columns. None stands for all columns.
+        :param filters: Dictionary describing the filter applied on the server, e.g., {'gvkey': [...]}.
+        :return: Hexadecimal digest identifying the table.
+        """
+        description = {'library': library, 'table': table,
+                       'columns': sorted(columns) if columns is not None else None,
+                       'filters': filters}
+        encoded = json.dumps(description, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha1(encoded).hexdigest()
+
+    def get(self, library: str, table: str, columns: list = None, filters: dict = None):
+        """
+        Looks up a table in the cache.
+        :return: The cached table as a Pandas DataFrame, or None if the table is not cached, has expired, or was
+        removed by another process while it was read.
+        """
+        key = self.key(library, table, columns, filters)
+        data_path, meta_path = self._paths(key)
+        metadata = self._read_metadata(meta_path)
+        if metadata is None:
+            return None
+        if self._expired(metadata):
+            self._remove(key)
+            return None
+
+        pq = self._import_parquet()
+        try:
+            df = pq.read_table(data_path).to_pandas()
+            # The modification time of the data file records the last use, which is used for eviction.
+            os.utime(data_path)
+        except (OSError, ValueError):
+            # Errors from pyarrow are OSErrors (e.g., a missing file) or ValueErrors (e.g., a broken file).
+            return None
+        return df
+
+    def put(self, df: DataFrame, library: str, table: str, columns: list = None, filters: dict = None,
+            **metadata):
+        """
+        Stores a table in the cache and evicts old tables if the cache exceeds its size limit.
+        :param df: The table.
+        :param metadata: Additional information to be stored alongside the table.
+        """
+        pa, pq = self._import_pyarrow(), self._import_parquet()
+        key = self.key(library, table, columns, filters)
+        data_path, meta_path = self._paths(key)
+
+        # The metadata is written last, as entries without metadata are not read.
+        self._write_atomically(data_path, lambda path: pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                                                                      path))
+        metadata.update({'library': library, 'table': table, 'columns': columns, 'filters': filters,
+                         'created': datetime.now().isoformat()})
+
+        def write_metadata(path):
+            with open(path, 'w') as file:
+                json.dump(metadata, file, default=str)
+        self._write_atomically(meta_path, write_metadata)
+
+        self.evict()
+
+    def metadata(self, library: str, table: str, columns: list = None, filters: dict = None):
+        """
+        :return: The metadata stored with a table, or None if the table is not cached.
+        """
+        _, meta_path = self._paths(self.key(library, table, columns, filters))
+        return self._read_metadata(meta_path)
+
+    def invalidate(self, library: str = None, table: str = None):
+        """
+        Removes tables from the cache. If no library and table are specified, the whole cache is cleared.
+        :param library: Only remove tables from this library.
+        :param table: Only remove tables with this name.
+        """
+        for key, metadata in self._entries():
+            if library is not None and metadata.get('library') != library:
+                continue
+            if table is not None and metadata.get('table') != table:
+                continue
+            self._remove(key)
+
+    def evict(self):
+        """
+        Removes expired tables, and removes the least recently used tables until the cache fits within max_bytes.
+        """
+        entries = []
+        for key, metadata in self._entries():
+            if self._expired(metadata):
+                self._remove(key)
+                continue
+            data_path, _ = self._paths(key)
+            try:
+                entries.append((os.path.getmtime(data_path), os.path.getsize(data_path), key))
+            except OSError:
+                # The table has been removed by another process.
+                continue
+
+        if self.max_bytes is None:
+            return
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            self._remove(key)
+            total_size -= size
+
+    def size(self):
+        """
+        :return: Size of the cached tables on disk, in bytes.
+        """
+        size = 0
+        for key, _ in self._entries():
+            try:
+                size += os.path.getsize(self._paths(key)[0])
+            except OSError:
+                continue
+        return size
+
+    def _entries(self):
+        """
+        Yields the key and metadata of every table in the cache. Tables whose metadata cannot be read (e.g., as another
+        process removed them) are skipped.
+        """
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.json'):
+                metadata = self._read_metadata(os.path.join(self.directory, file_name))
+                if metadata is not None:
+                    yield file_name[:-len('.json')], metadata
+
+    def _expired(self, metadata: dict):
+        if self.ttl is None:
+            return False
+        return datetime.fromisoformat(metadata['created']) + self.ttl < datetime.now()
+
+    def _paths(self, key: str):
+        return os.path.join(self.directory, key + '.parquet'), os.path.join(self.directory, key + '.json')
+
+    def _remove(self, key: str):
+        # The metadata is removed first, so that the table is not read while it is removed.
+        for path in reversed(self._paths(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process has removed the file already.
+                pass
+
+    @staticmethod
+    def _write_atomically(path: str, write):
+        """
+        Writes a file under a temporary name that is unique to the writer, and then renames it, so that other processes
+        never read a file that is only partly written, and writers of the same table do not overwrite each other's
+        temporary files.
+        :param path: Path of the file.
+        :param write: Function that writes the file to the path it receives.
+        """
+        handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(handle)
+        try:
+            write(temporary_path)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    @staticmethod
+    def _read_metadata(meta_path: str):
+        """
+        :return: The metadata in a file, or None if the file does not exist or cannot be read.
+        """
+        try:
+            with open(meta_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _import_pyarrow():
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('The table cache stores tables in the Parquet format and requires pyarrow. Install it '
+                              'with "pip install pyarrow".')
+        return pyarrow
+
+    @classmethod
+    def _import_parquet(cls):
+        cls._import_pyarrow()
+        import pyarrow.parquet
+        return pyarrow.parquet
@@ -0,0 +1,142 @@
+import threading
+
+import pandas as pd
+
+from collections import OrderedDict
+from pandas import DataFrame
+
+from wrds_tools.dtypes import memory_usage
+
+
+class SharedTableStore:
+    """
+    Holds the tables downloaded from WRDS in memory, for all WrdsConnection objects in a process that use the store. A
+    table that one connection has downloaded is handed to the other connections instead of being downloaded (and held)
+    once per connection. If the tables in the store use more memory than max_bytes, the tables that were used least
+    recently are removed from the store. Their memory is released once no connection uses them anymore.
+    Under pandas' copy-on-write (always enabled from pandas 3.0 on, and enabled on pandas 2.x with
+    pd.set_option('mode.copy_on_write', True)), the connections receive views of the stored tables, which share their
+    memory: changing a view copies the changed columns and leaves the stored table untouched. Without copy-on-write,
+    the connections receive copies of the stored tables, so that no connection can change a table for the others. The
+    tables are then still downloaded once, but held once per connection.
+
+    :param max_bytes: Maximum memory used by the stored tables, including the contents of string columns. If not
+    provided, the size of the store is not bounded.
+    """
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = max_bytes
+        # Key -> (table name, dataframe, bytes), ordered from least to most recently used.
+        self._tables = OrderedDict()
+        self._lock = threading.RLock()
+        # Key -> [lock, number of waiting connections] of the keys that are being loaded, so that a table is only
+        # downloaded once at a time. A key is removed once no connection waits for it anymore.
+        self._loading = {}
+
+    def get(self, key):
+        """
+        :param key: Hashable key of the table.
+        :return: A view (or copy, see above) of the stored table, or None if the table is not stored.
+        """
+        with self._lock:
+            if key not in self._tables:
+                return None
+            self._tables.move_to_end(key)
+            return _view(self._tables[key][1])
+
+    def put(self, key, df: DataFrame, name: str = None):
+        """
+        Stores a table, and removes the least recently used tables if the store exceeds its size limit. The table that
+        is stored is never removed right away, even if it exceeds the limit on its own.
+        :param key: Hashable key of the table.
+        :param df: The table.
+        :param name: Name of the table in the memory report, e.g., 'compa.names'.
+        :return: A view (or copy) of the stored table.
+        """
+        with self._lock:
+            self._tables[key] = (name, df, memory_usage(df))
+            self._tables.move_to_end(key)
+            self._evict(keep=key)
+            return _view(df)
+
+    def get_or_load(self, key, load, name: str = None):
+        """
+        Returns a view of a stored table, or loads and stores the table if it is not stored. If several connections
+        request a table that is not stored at the same time, the table is loaded once and the other connections wait
+        for it.
+        :param key: Hashable key of the table.
+        :param load: Function without arguments that returns the table.
+        :param name: Name of the table in the memory report.
+        :return: A view (or copy) of the stored table.
+        """
+        with self._lock:
+            loading = self._loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+        try:
+            with loading[0]:
+                df = self.get(key)
+                if df is None:
+                    df = self.put(key, load(), name=name)
+        finally:
+            with self._lock:
+                loading[1] -= 1
+                if loading[1] == 0 and self._loading.get(key) is loading:
+                    del self._loading[key]
+        return df
+
+    def remove(self, key):
+        """
+        Removes a table from the store.
+        """
+        with self._lock:
+            self._tables.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all tables from the store, e.g., to download current versions of the tables.
+        """
+        with self._lock:
+            self._tables.clear()
+
+    def size(self):
+        """
+        :return: Memory used by the stored tables, in bytes.
+        """
+        with self._lock:
+            return sum(size for _, _, size in self._tables.values())
+
+    def memory_report(self):
+        """
+        :return: Pandas dataframe with the name, number of rows and bytes of every stored table, from least to most
+        recently used.
+        """
+        with self._lock:
+            return DataFrame([{'table': name, 'rows': len(df), 'bytes': size}
+                              for name, df, size in self._tables.values()], columns=['table', 'rows', 'bytes'])
+
+    def _evict(self, keep):
+        if self.max_bytes is None:
+            return
+        total_size = sum(size for _, _, size in self._tables.values())
+        for key in list(self._tables):
+            if total_size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total_size -= self._tables.pop(key)[2]
+
+
+def _view(df: DataFrame):
+    """
+    :return: A view of a stored table if pandas' copy-on-write is enabled, as changes to the view then leave the stored
+    table untouched. Otherwise, a copy.
+    """
+    copy_on_write = int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+    return df.copy(deep=not copy_on_write)
+
+
+# Size limit of the default store. Tables that do not fit are released once no connection uses them anymore. The limit
+# can be changed by setting shared_table_store.max_bytes.
+DEFAULT_MAX_BYTES = 2 ** 30
+
+# The store used by all connections that are not given a store of their own.
+shared_table_store = SharedTableStore(max_bytes=DEFAULT_MAX_BYTES)
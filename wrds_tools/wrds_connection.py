@@ -1,12 +1,30 @@
-import wrds as _wrds
+import itertools
 import pandas as pd
+import threading
 import warnings
+import weakref
 
+from concurrent.futures import ThreadPoolExecutor
 from itertools import compress
 from pandas import DataFrame
+from pandas.api.extensions import ExtensionDtype
+from pandas.api.types import CategoricalDtype
 from datetime import date, datetime
 import numpy as np
 
+from wrds_tools.dataset_io import write_dataset
+from wrds_tools.download_checkpoints import DownloadCheckpoints
+from wrds_tools.dtypes import apply_dtypes, concat_tables, memory_usage
+from wrds_tools.index_membership import IndexMembership
+from wrds_tools.instrumentation import Instrumentation, instrumented
+from wrds_tools.query_plan import QueryPlan
+from wrds_tools.table_cache import TableCache
+from wrds_tools.table_store import SharedTableStore, shared_table_store
+
+# Numbers that identify the database connections passed in with the db parameter, in the keys of the table store.
+_passed_databases = weakref.WeakKeyDictionary()
+_database_numbers = itertools.count()
+
 
 def print_setup_instructions():
     """
@@ -42,14 +60,67 @@ class WrdsConnection:
     sample.
     :param observation_start_date: datetime.date instance with first day of observation period.
     :param observation_end_date: datetime.date instance with last day of observation period.
-    :ivar db: Saves your connection to the wrds database.
+    :param cache: A TableCache instance. If provided, downloaded tables are stored on disk and reused by later
+    connections instead of being downloaded again.
+    :param compact_floats: Store the financial items of the executive and annual tables as 32-bit instead of 64-bit
+    floats, which halves their memory use at a precision of about seven significant digits.
+    :param checkpoint_dir: Directory for the parts of large table downloads. If provided, full downloads of the
+    executive and annual tables are split into ranges of years, and every finished range is stored in this directory.
+    A download that is interrupted resumes with the first range that was not finished when it is started again.
+    :param db: An open connection to use instead of connecting to WRDS, e.g., a local stand-in for the WRDS database.
+    Must provide an SQLAlchemy engine as its engine attribute, like wrds.Connection. It is not replaced if it is lost.
+    :param table_store: A SharedTableStore instance that holds the downloaded tables in memory. Connections that use
+    the same store share the tables they download. If not provided, the store shared by all connections in the process
+    is used, which holds up to table_store.DEFAULT_MAX_BYTES bytes of tables.
+    :param instrumentation: An Instrumentation instance. If provided, the wall time, rows, memory and queries of every
+    public method and download helper are recorded in it.
+    :ivar db: Saves your connection to the wrds database. The connection is opened when it is first used, and opened
+    again if it is lost.
     :ivar dataset: Dataset of Panda DataFrame type that holds the data extracted from WRDS.
     :return: An object that holds the wrds connection object.
     """
+    # Fields that can be added from the "NAMES" table, mapped to their column in the table.
+    names_fields = {'name': 'conm', 'ticker': 'tic', 'cusip': 'cusip', 'CIK': 'cik', 'exit_year': 'year2',
+                    'ipo_date': 'ipodate', 'SIC': 'sic', 'NAICS': 'naics'}
+    # Fields of the "NAMES" table that are transformed, as SQL expressions for the deferred mode.
+    _names_field_expressions = {'exit_year': 'n.year2 + 1'}
+    # Names under which columns from the "FUNDA" table are added to the dataset.
+    _annuals_renames = {'revt': 'revenue', 'xrd': 'r_n_d', 'xstfws': 'wages_and_salaries', 'fyrc': 'fiscal_year_end',
+                        'tic': 'ticker'}
+    # Sets of up to temp_table_threshold gvkeys are sent to the server as lists of in_list_size gvkeys. Larger sets are
+    # uploaded into a temporary table.
+    in_list_size = 1000
+    temp_table_threshold = 10000
+    # Industry classification systems, mapped to the table and column they are stored in.
+    _classifier_sources = {'SIC': ('names', 'sic'), 'NAICS': ('names', 'naics'), 'GICS_group': ('company', 'ggroup'),
+                           'GICS_industry': ('company', 'gind'), 'GICS_sector': ('company', 'gsector'),
+                           'GICS_subindustry': ('company', 'gsubind'), 'SP_industry': ('company', 'spcindcd'),
+                           'SP_sector': ('company', 'spcseccd')}
+    # Fields that are computed on the server from the columns of the "COMPANY" table, mapped to their SQL expressions.
+    # {table} stands for the prefix of the columns: empty in downloads of the table, "c." in deferred queries.
+    # concat_ws skips missing address lines, and nullif marks companies without any address line as missing.
+    _company_expressions = {'address': "nullif(concat_ws('\n', {table}add1, {table}add2, {table}add3, {table}add4), "
+                                       "'')"}
+    # Year columns by which full downloads of large tables are split into ranges of checkpoint_years years, if a
+    # checkpoint directory is provided.
+    _range_columns = {'anncomp': 'year', 'funda': 'fyear'}
+    checkpoint_years = 5
+    # Tables that can be synced incrementally (see sync_table), mapped to their library and to the year or date columns
+    # that record when a row changes.
+    _sync_columns = {'funda': ('compa', ['fyear'], 'year'), 'anncomp': ('execcomp', ['year'], 'year'),
+                     'idxcst_his': ('compa', ['from', 'thru'], 'date')}
+
     def __init__(self, wrds_username: str, selection_start_date: date = None,
                  selection_end_date: date = None, observation_start_date: date = None,
-                 observation_end_date: date = None):
+                 observation_end_date: date = None, cache: TableCache = None, compact_floats=False,
+                 checkpoint_dir: str = None, db=None, table_store: SharedTableStore = None,
+                 instrumentation: Instrumentation = None):
         self.username = wrds_username
+        self.table_store = table_store if table_store is not None else shared_table_store
+        self.instrumentation = instrumentation
+        self.cache = cache
+        self.compact_floats = compact_floats
+        self.checkpoints = DownloadCheckpoints(checkpoint_dir) if checkpoint_dir is not None else None
 
         self.selection_start_date = selection_start_date
         self.selection_end_date = selection_end_date
@@ -59,9 +130,54 @@ class WrdsConnection:
         self.dataset = None
         self._names_table = None
         self._company_table = None
+        # Whether the company table only holds some of the columns of the table, see _download_company_table.
+        self._company_projected = False
         self._executive_table = None
         self._annuals_table = None
+        # The full "IDXCST_HIS" table, if it is held locally (as by the workers of build_samples). The index
+        # constituents are then selected from this table instead of on the server.
+        self._constituents_table = None
+        # The gvkeys, years and columns held by the executive and annual tables, see _scope_covers.
+        self._executive_scope = None
+        self._annuals_scope = None
+        self._plan = None
+        # Background downloads started by prefetch, by table.
+        self._executor = None
+        self._prefetched = {}
+        # Index membership engines, by tuple of index keys.
+        self._memberships = {}
+        # Key indexes of the downloaded tables, see _attach_columns. The tables are only referenced weakly, and their
+        # indexes are removed once they are released.
+        self._lookup_indexes = {}
+
+        # The connection to the WRDS server is only opened when the first query is run, see the db property.
+        self._db = db
+        # Connections that are passed in are not replaced when they are lost.
+        self._reconnect = db is None
+        # Prefetch threads may open the connection at the same time.
+        self._connect_lock = threading.Lock()
+
+    @property
+    def db(self):
+        """
+        The connection to the WRDS database. Opened on first use.
+        """
+        with self._connect_lock:
+            if self._db is None:
+                self._db = self._connect()
+        return self._db
+
+    @db.setter
+    def db(self, db):
+        self._db = db
+        self._reconnect = db is None
 
+    def _connect(self):
+        """
+        Opens a connection to the WRDS server.
+        """
+        # Importing wrds takes a while, so it is only imported when a connection is needed.
+        import wrds
         # To build a connection to the wrds server via python, a .pgpass file is required in the user's home
         # directory, with access limited to the user.
         # To create this file, follow the instructions here:
@@ -69,7 +185,7 @@ class WrdsConnection:
         # After creating the file, don't forget to run "chmod 0600 ~/.pgpass" in the console to limit access.
         # Access issue also described here:
         # https://www.postgresql.org/docs/9.5/libpq-pgpass.html.
-        self.db = _wrds.Connection(wrds_username=self.username)
+        return wrds.Connection(wrds_username=self.username)
 
     def set_selection_period(self, start_date: date = None, end_date: date = None):
         """
@@ -93,7 +209,8 @@ class WrdsConnection:
         self.observation_start_date = start_date
         self.observation_end_date = end_date
 
-    def build_sp500(self, rename_columns=True, drop_uninformative=True):
+    @instrumented
+    def build_sp500(self, rename_columns=True, drop_uninformative=True, index_key='000003'):
         """
         Download S&P constituents from compustat. Constituents are recorded in the "IDXCST_HIS" table in "COMPA"
         library. The table records companies that joined various stock indices, when they joined, and when they were
@@ -103,44 +220,173 @@ class WrdsConnection:
         :param rename_columns: Should the original column names from compustat be retained, or changed to more sensible
         column names?
         :param drop_uninformative: Should selected uninformative columns be dropped?
+        :param index_key: Global Index Key (gvkeyx) of the index, or a list of index keys. Defaults to "000003", the key
+        of the S&P 500.
         """
-        constituents_all_indexes = self.db.get_table(library='compa', table='idxcst_his')
-
-        # "000003" is the Global Index Key of the S&P 500.
-        dataset_raw = constituents_all_indexes[constituents_all_indexes.gvkeyx == '000003']
-
-        # Filter observations by removing companies that joined/were dropped from the S&P 500 after/before the selection
-        # period.
-        if (self.selection_start_date is not None) and (self.selection_end_date is not None):
-            # We filter for observations that fall within the observation period by identifying index constituents that
-            # either dropped out before the observation period, or joined after, and then taking all companies that do
-            # not match one of those two cases.
-            after = dataset_raw['from'] >= self.selection_end_date
-            before = dataset_raw['thru'] <= self.selection_start_date
-            self.dataset = dataset_raw[~before & ~after]
-        # If only a start data is selected, we filter only by excluding companies that left the index before the start
-        # date.
-        elif self.selection_start_date is not None:
-            before = dataset_raw['thru'] <= self.selection_start_date
-            self.dataset = dataset_raw[~before]
-        # If a selection end date is provided, remove companies that joined the S&P 500 after the selection period
-        # ended.
-        elif self.selection_end_date is not None:
-            after = dataset_raw['from'] >= self.selection_end_date
-            self.dataset = dataset_raw[~after]
+        sql, params = self._index_constituents_sql(index_key, rename_columns, drop_uninformative)
+        if self._plan is not None:
+            self._plan.set_sample(sql, params)
+        elif self._constituents_table is not None:
+            self.dataset = self._select_index_constituents(index_key, rename_columns, drop_uninformative)
         else:
-            self.dataset = dataset_raw.copy()
+            self.dataset = apply_dtypes(self._read_sql(sql, params=params), 'idxcst_his')
 
-        # Some companies are dropped from the S&P 500 and later join again. This leads to duplicates in the data that we
+    def _index_constituents_sql(self, index_key, rename_columns=True, drop_uninformative=True):
+        """
+        Builds the query for the index constituents that are selected into the sample (see build_sp500).
+        :return: Tuple with the SQL query and the query parameters.
+        """
+        if isinstance(index_key, str):
+            index_key = [index_key]
+
+        # The index filter, the selection period and the removal of duplicates are all run on the WRDS server, so that
+        # only the constituents we keep are transferred, instead of the constituent history of every index.
+        conditions = ['gvkeyx in %(index_keys)s']
+        params = {'index_keys': tuple(index_key)}
+        # Filter observations by removing companies that joined/were dropped from the index after/before the selection
+        # period. Companies that are still in the index have no "thru" date.
+        if self.selection_start_date is not None:
+            conditions.append('(thru is null or thru > %(selection_start)s)')
+            params['selection_start'] = self.selection_start_date
+        if self.selection_end_date is not None:
+            conditions.append('"from" < %(selection_end)s')
+            params['selection_end'] = self.selection_end_date
+
+        # Some companies are dropped from the index and later join again. This leads to duplicates in the data that we
         # filter out here. The last observation is retained (we expect observations to be equal).
-        self.dataset = self.dataset.drop_duplicates(subset='gvkey', keep='last')
-
         if drop_uninformative:
             # The only column that has value beyond the index are the index constituents, specified in the gvkey column.
-            self.dataset = self.dataset[['gvkey']]
+            columns = 'gvkey'
         # All columns with bad column names to be renamed here are also columns that would be dropped.
         elif rename_columns:
-            self.dataset = self.dataset.rename(columns={'from': 'joined_sp500', 'thru': 'left_sp500'})
+            columns = 'gvkey, iid, gvkeyx, "from" as joined_sp500, thru as left_sp500'
+        else:
+            columns = 'gvkey, iid, gvkeyx, "from", thru'
+        sql = ('select {columns} from ('
+               'select *, row_number() over (partition by gvkey order by "from" desc) as duplicate_rank '
+               'from compa.idxcst_his where {conditions}) as constituents '
+               'where duplicate_rank = 1 order by gvkey').format(columns=columns, conditions=' and '.join(conditions))
+        return sql, params
+
+    def _select_index_constituents(self, index_key, rename_columns=True, drop_uninformative=True):
+        """
+        Selects the index constituents from the locally held "IDXCST_HIS" table, in the same way as the query built by
+        _index_constituents_sql.
+        :return: Pandas dataframe.
+        """
+        table = self._constituents_table
+        keep = table['gvkeyx'].isin([index_key] if isinstance(index_key, str) else list(index_key)).to_numpy()
+        from_dates, thru_dates = pd.to_datetime(table['from']), pd.to_datetime(table['thru'])
+        if self.selection_start_date is not None:
+            keep = keep & (thru_dates.isna() | (thru_dates > pd.Timestamp(self.selection_start_date))).to_numpy()
+        if self.selection_end_date is not None:
+            keep = keep & (from_dates < pd.Timestamp(self.selection_end_date)).to_numpy()
+
+        # The last observation of companies that joined the index several times is retained.
+        constituents = table[keep].assign(joined=from_dates[keep])
+        constituents = constituents.sort_values(['gvkey', 'joined'], kind='stable').drop_duplicates('gvkey', keep='last')
+        if drop_uninformative:
+            columns = {'gvkey': 'gvkey'}
+        elif rename_columns:
+            columns = {'gvkey': 'gvkey', 'iid': 'iid', 'gvkeyx': 'gvkeyx', 'from': 'joined_sp500', 'thru': 'left_sp500'}
+        else:
+            columns = {'gvkey': 'gvkey', 'iid': 'iid', 'gvkeyx': 'gvkeyx', 'from': 'from', 'thru': 'thru'}
+        return constituents[list(columns)].rename(columns, axis='columns').reset_index(drop=True)
+
+    @instrumented
+    def index_membership(self, index_key='000003'):
+        """
+        Downloads the full constituent history of one or several indices from the "IDXCST_HIS" table, including
+        companies that left and joined an index again, and returns it as an IndexMembership object for vectorized
+        point-in-time membership queries.
+        :param index_key: Global Index Key (gvkeyx) of the index, or a list of index keys. Defaults to "000003", the key
+        of the S&P 500.
+        :return: IndexMembership object.
+        """
+        index_keys = tuple(sorted([index_key] if isinstance(index_key, str) else index_key))
+        if index_keys not in self._memberships:
+            # A locally held copy of the table, or a copy that is kept up to date with sync_table, is used instead of
+            # the server.
+            stored = self._constituents_table
+            if stored is None and self.cache is not None:
+                stored = self.cache.get(library='compa', table='idxcst_his', filters=self._cache_filters())
+            if stored is not None:
+                constituents = stored[stored['gvkeyx'].isin(index_keys)]
+            else:
+                constituents = self._read_sql('select gvkeyx, gvkey, "from", thru from compa.idxcst_his '
+                                              'where gvkeyx in %(index_keys)s', params={'index_keys': index_keys})
+            self._memberships[index_keys] = IndexMembership(constituents)
+        return self._memberships[index_keys]
+
+    @instrumented
+    def build_index_panel(self, index_key='000003', start_year: int = None, end_year: int = None):
+        """
+        Builds a panel of company-years from the constituent history of an index: one row for every year in which a
+        company was in the index at any time. Unlike build_sp500, companies that left the index and joined again are
+        only in the panel for the years of their membership.
+        :param index_key: Global Index Key (gvkeyx) of the index, or a list of index keys. Defaults to "000003", the key
+        of the S&P 500.
+        :param start_year: First year of the panel. Defaults to the first year of the observation period.
+        :param end_year: Last year of the panel. Defaults to the last year of the observation period.
+        """
+        first_year, last_year = self._observation_years()
+        start_year = start_year if start_year is not None else first_year
+        end_year = end_year if end_year is not None else last_year
+        if start_year is None or end_year is None:
+            raise ValueError('Provide start and end year, or set an observation period, to build a panel.')
+        self.dataset = self.index_membership(index_key).firm_years(start_year, end_year, index_key)
+
+    @instrumented
+    def add_index_membership(self, index_key='000003', column_name='in_index'):
+        """
+        Adds a column that indicates whether a company was in an index at any time in the year of the observation.
+        Requires a year column in the dataset (see add_executives and add_company_info).
+        :param index_key: Global Index Key (gvkeyx) of the index. Defaults to "000003", the key of the S&P 500.
+        :param column_name: Name of the new column.
+        """
+        if not isinstance(self.dataset, DataFrame):
+            raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
+        if 'year' not in list(self.dataset):
+            raise NoDatasetError('The dataset has no year column. Add executives or company info first.')
+        self.dataset[column_name] = self.index_membership(index_key).is_member_in_year(
+            self.dataset['gvkey'], self.dataset['year'], index_key)
+
+    def defer(self):
+        """
+        Switches the connection to deferred mode. In deferred mode, build_sp500, load_gvkeys, filter_by_industry and the
+        add_* methods do not download any data, but only record the sample, filters and columns requested. Calling
+        collect then runs one query on the WRDS server that joins all requested tables, restricted to the sample and
+        the observation period.
+        """
+        if self.dataset is not None:
+            raise ValueError('Deferred mode starts a new sample, but a dataset has already been built.')
+        self._plan = QueryPlan()
+
+    @instrumented
+    def collect(self):
+        """
+        Runs the query recorded in deferred mode, stores the result as the dataset and leaves deferred mode.
+        :return: Pandas dataframe of the gathered dataset.
+        """
+        if self._plan is None or not self._plan.has_sample():
+            raise NoDatasetError('No query plan recorded. Call defer and select a sample first.')
+
+        sql, params = self._plan.sql()
+        self.dataset = self._read_sql(sql, params=params)
+        self._plan = None
+        self._categorize_classifiers()
+        return self.dataset
+
+    def _deferred(self):
+        """
+        :return: True if the connection is in deferred mode, in which case operations are recorded in the query plan
+        instead of being run.
+        """
+        if self._plan is None:
+            return False
+        if not self._plan.has_sample():
+            raise NoDatasetError('No sample selected yet. Cannot add operations to the query plan.')
+        return True
 
     def head(self, n=5):
         """
@@ -151,73 +397,82 @@ class WrdsConnection:
             raise NoDatasetError('No dataset downloaded yet. Cannot display data head.')
         return self.dataset.head(n)
 
-    def add_names(self):
+    @instrumented
+    def add_names_fields(self, fields: list):
         """
-        Adds the company name from the "NAMES" table in compustat's "COMPA" library.
+        Adds several fields from the "NAMES" table in compustat's "COMPA" library in a single join. Fields that are
+        already in the dataset are skipped.
+        :param fields: List of fields to add. Available fields are the keys of the names_fields attribute: 'name',
+        'ticker', 'cusip', 'CIK', 'exit_year', 'ipo_date', 'SIC' and 'NAICS'.
         """
+        unknown_fields = [field for field in fields if field not in self.names_fields]
+        if unknown_fields:
+            raise ValueError('Unknown fields: {0}. Available fields: {1}.'.format(unknown_fields,
+                                                                                 list(self.names_fields)))
+
+        if self._deferred():
+            self._plan.add_columns('names', {field: self._names_field_expressions.get(field,
+                                                                                      'n.' + self.names_fields[field])
+                                             for field in fields})
+            return
         if not isinstance(self.dataset, DataFrame):
             raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
 
+        fields = [field for field in dict.fromkeys(fields) if field not in list(self.dataset)]
+        if not fields:
+            return
+
         self._download_names_table()
-        self.dataset = self.dataset.merge(self._names_table[['gvkey', 'conm']], on='gvkey', how='left')
-        self.dataset = self.dataset.rename(columns={'conm': 'name'})
+        self._attach_columns(self._names_table, {self.names_fields[field]: field for field in fields}, on=['gvkey'],
+                             cache_name='names')
+        if 'exit_year' in fields:
+            # The year2 column provides the last year for which accounting data is available, therefore, the exit year
+            # is that year added 1.
+            self.dataset['exit_year'] = self.dataset['exit_year'] + 1
+
+    @instrumented
+    def add_names(self):
+        """
+        Adds the company name from the "NAMES" table in compustat's "COMPA" library.
+        """
+        self.add_names_fields(['name'])
 
+    @instrumented
     def add_ticker(self):
         """
         Adds the ticker number from the "NAMES" table in compustat's "COMPA" library.
         """
-        if not isinstance(self.dataset, DataFrame):
-            raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
-
-        self._download_names_table()
-        self.dataset = self.dataset.merge(self._names_table[['gvkey', 'tic']], on='gvkey', how='left')
-        self.dataset = self.dataset.rename(columns={'tic': 'ticker'})
+        self.add_names_fields(['ticker'])
 
+    @instrumented
     def add_cusip(self):
         """
         Adds the cusip code from the "NAMES" table in compustat's "COMPA" library.
         """
-        if not isinstance(self.dataset, DataFrame):
-            raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
-
-        self._download_names_table()
-        self.dataset = self.dataset.merge(self._names_table[['gvkey', 'cusip']], on='gvkey', how='left')
+        self.add_names_fields(['cusip'])
 
+    @instrumented
     def add_cik(self):
         """
         Adds the CIK code from the "NAMES" table in compustat's "COMPA" library.
         """
-        if not isinstance(self.dataset, DataFrame):
-            raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
-
-        self._download_names_table()
-        self.dataset = self.dataset.merge(self._names_table[['gvkey', 'CIK']], on='gvkey', how='left')
+        self.add_names_fields(['CIK'])
 
+    @instrumented
     def add_exit_year(self):
         """
         Adds the exit year from the "NAMES" table in compustat's "COMPA" library.
         """
-        if not isinstance(self.dataset, DataFrame):
-            raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
-
-        self._download_names_table()
-        self.dataset = self.dataset.merge(self._names_table[['gvkey', 'year2']], on='gvkey', how='left')
-        # The year2 column provides the last year for which accounting data is available, therefore, the exit year is
-        # that year added 1.
-        self.dataset['year2'] = self.dataset['year2'] + 1
-        self.dataset = self.dataset.rename(columns={'year2': 'exit_year'})
+        self.add_names_fields(['exit_year'])
 
+    @instrumented
     def add_ipo_date(self):
         """
         Adds the IPO year (or year of merger) from the "NAMES" table in compustat's "COMPA" library.
         """
-        if not isinstance(self.dataset, DataFrame):
-            raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
-
-        self._download_names_table()
-        self.dataset = self.dataset.merge(self._names_table[['gvkey', 'ipodate']], on='gvkey', how='left')
-        self.dataset = self.dataset.rename(columns={'ipodate': 'ipo_date'})
+        self.add_names_fields(['ipo_date'])
 
+    @instrumented
     def add_industry_classifiers(self, get_gics=False, get_sp=False):
         """
         Adds two common industry classifiers, SIC and NAICS, from the "NAMES" table in compustat's "COMPA" library.
@@ -228,54 +483,71 @@ class WrdsConnection:
         https://wrds-web.wharton.upenn.edu/wrds/query_forms/variable_documentation.cfm?vendorCode=COMP&libraryCode=COMPA&fileCode=COMPANY&id=ggroup
         https://us.spindices.com/governance/methodology-information/
         """
+        if self._deferred():
+            self.add_names_fields(['SIC', 'NAICS'])
+            if get_gics:
+                self._plan.add_columns('company', {'GICS_group': 'c.ggroup', 'GICS_industry': 'c.gind',
+                                                   'GICS_sector': 'c.gsector', 'GICS_subindustry': 'c.gsubind'})
+            if get_sp:
+                self._plan.add_columns('company', {'SP_industry': 'c.spcindcd', 'SP_sector': 'c.spcseccd'})
+            return
         if not isinstance(self.dataset, DataFrame):
             raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
 
-        self._download_names_table()
         if get_gics or get_sp:
-            self._download_company_table()
+            self._download_company_table((['ggroup', 'gind', 'gsector', 'gsubind'] if get_gics else []) +
+                                         (['spcindcd', 'spcseccd'] if get_sp else []))
 
         # We split the operation into three parts (SIC/NAICS, GICS and S&P classification system) to leave the original
         # data untouched and only change the data in our custom dataset.
 
-        if 'SIC' not in list(self.dataset):
-            self.dataset = self.dataset.merge(self._names_table[['gvkey', 'sic', 'naics']], on='gvkey', how='left')
-            self.dataset.rename(columns={'sic': 'SIC', 'naics': 'NAICS'}, inplace=True)
+        self.add_names_fields(['SIC', 'NAICS'])
 
         if get_gics and 'GICS_group' not in list(self.dataset):
-            self.dataset = self.dataset.merge(self._company_table[['gvkey', 'ggroup', 'gind', 'gsector', 'gsubind']],
-                                              on='gvkey', how='left')
-            self.dataset.rename(columns={'ggroup': 'GICS_group',
-                                         'gind': 'GICS_industry',
-                                         'gsector': 'GICS_sector',
-                                         'gsubind': 'GICS_subindustry'}, inplace=True)
+            self._attach_columns(self._company_table, {'ggroup': 'GICS_group',
+                                                       'gind': 'GICS_industry',
+                                                       'gsector': 'GICS_sector',
+                                                       'gsubind': 'GICS_subindustry'},
+                                 on=['gvkey'], cache_name='company')
 
         if get_sp and 'SP_industry' not in list(self.dataset):
-            self.dataset = self.dataset.merge(self._company_table[['gvkey', 'spcindcd', 'spcseccd']],
-                                              on='gvkey', how='left')
-            self.dataset.rename(columns={'spcindcd': 'SP_industry', 'spcseccd': 'SP_sector'}, inplace=True)
+            self._attach_columns(self._company_table, {'spcindcd': 'SP_industry', 'spcseccd': 'SP_sector'},
+                                 on=['gvkey'], cache_name='company')
 
+        self._categorize_classifiers()
+
+    def _categorize_classifiers(self):
+        """
+        Cleans up the industry classifier columns in the dataset and stores them as categories.
+        """
         # A bit of collective cleanup.
         classification_systems = ['SIC', 'NAICS', 'GICS_group', 'GICS_industry', 'GICS_sector', 'GICS_subindustry',
                                   'SP_industry', 'SP_sector']
-        new_columns = [column for column in list(self.dataset) if column in classification_systems]
+        # Columns that were downloaded as categories already have a single missing value.
+        new_columns = [column for column in list(self.dataset) if column in classification_systems
+                       and not isinstance(self.dataset[column].dtype, CategoricalDtype)]
         # There are None values and np.nans in the dataset. One could look up whether those are different things in
         # the original SAS database, but for now we will just assume they are all missing values.
         self.dataset[new_columns] = self.dataset[new_columns].replace([np.nan], [None])
         # Note: changing type to category sets all None values to nan again.
         self.dataset[new_columns] = self.dataset[new_columns].astype('category')
 
+    @instrumented
     def add_executives(self, ceo_only=False):
         """
         Adds to your dataset the compustat the execid and year. The execid can the be used to download further data on
         executives, via the add_executive_info method.
         :param ceo_only: Only info on CEOs is added to the dataset.
         """
+        if self._deferred():
+            if not self._plan.has_columns('execid'):
+                self._plan.add_executives(ceo_only, self._observation_years())
+            return
         if 'execid' in list(self.dataset):
             print('Executives already added to the dataset. Executives will not be merged in again.')
             return
 
-        self._download_executive_table()
+        self._download_executive_table(gvkeys=self.dataset['gvkey'].unique(), years=self._observation_years())
         join_data = self._executive_table[['execid', 'year', 'gvkey']].copy()
         if ceo_only:
             join_data = join_data[join_data['ceoann'] == 'CEO']
@@ -290,8 +562,9 @@ class WrdsConnection:
         else:
             self.dataset = pd.merge(self.dataset, join_data, how='left', on=['gvkey', 'year'])
 
-        self.dataset.reset_index(drop=True, inplace=True)
+        self._sort_dataset()
 
+    @instrumented
     def add_executive_info(self, add_title = False, add_full_name = False, add_salary = False,
                            add_bonus = False, add_ceo_flag = False):
         """
@@ -308,6 +581,14 @@ class WrdsConnection:
         else:
             self.add_executives()
 
+        if self._deferred():
+            self._plan.add_columns('executives', dict(compress(
+                [('personnel_title', 'e.titleann'), ('personnel_full_name', 'e.exec_fullname'),
+                 ('personnel_salary', 'e.salary'), ('personnel_bonus', 'e.bonus'),
+                 ('personnel_is_ceo', "coalesce(e.ceoann = 'CEO', false)")],
+                [add_title, add_full_name, add_salary, add_bonus, add_ceo_flag])))
+            return
+
         # ToDo: Control for columns already in the dataset.
 
         # A quick and elegant way to get a list of the column names we want to include.
@@ -315,29 +596,24 @@ class WrdsConnection:
         all_info_columns = ['titleann', 'exec_fullname', 'salary', 'bonus', 'ceoann']
         selected_columns = list(compress(all_info_columns, selections))
 
-        # ToDo: Merge takes the first matching entry. Consider taking the last one (mostly year end).
-        # Add the columns we are merging on.
-        merge_columns = selected_columns + ['execid', 'year', 'gvkey']
-
-        self.dataset = self.dataset.merge(self._executive_table[merge_columns], how='left',
-                                          on=['execid', 'year', 'gvkey'])
-
         info_columns_rename = ['personnel_title', 'personnel_full_name', 'personnel_salary', 'personnel_bonus',
                                'personnel_is_ceo']
         selected_columns_rename = list(compress(info_columns_rename, selections))
-        print('Added the following info on executives: {0}'.format(selected_columns_rename))
 
-        # ToDo make mapping dictionary an attribute of the WrdsConnection object. Then, use self.attribute_name below.
-        self.dataset = self.dataset.rename({'title_ann': 'personnel_title', 'exec_fullname': 'personnel_full_name',
-                                            'salary': 'personnel_salary', 'bonus': 'personnel_bonus',
-                                            'ceoann': 'personnel_is_ceo'},
-                                           axis='columns')
+        self._download_executive_table(gvkeys=self.dataset['gvkey'].unique(), years=self._dataset_years())
+        # ToDo: Merge takes the first matching entry. Consider taking the last one (mostly year end).
+        self._attach_columns(self._executive_table, dict(zip(selected_columns, selected_columns_rename)),
+                             on=['execid', 'year', 'gvkey'], cache_name='executives')
+        print('Added the following info on executives: {0}'.format(selected_columns_rename))
 
         # Transform CEO flag into boolean.
-        self.dataset['personnel_is_ceo'] = self.dataset['personnel_is_ceo'] == 'CEO'
+        if add_ceo_flag:
+            self.dataset['personnel_is_ceo'] = self.dataset['personnel_is_ceo'] == 'CEO'
 
+    @instrumented
     def add_company_info(self, revenue=True, r_n_d=False, wages_and_salaries=False, total_assets=False,
-                         fiscal_year_end=False, COGS=False, EBIT=False, EBITDA=False, TIC=False):
+                         fiscal_year_end=False, COGS=False, EBIT=False, EBITDA=False, TIC=False, stream=False,
+                         chunksize=100000):
         """
         Add company information (by year) from the "FUNDA" (fundamentals annual) table in the "COMPA" (company annual)
         library.
@@ -350,30 +626,46 @@ class WrdsConnection:
         :param EBIT: Add earnings before interest and taxes (EBIT).
         :param EBITDA: Add earnings before interest (EBITDA).
         :param ticker: Add ticker symbol (TIC).
+        :param stream: Instead of downloading the full table after asking for confirmation, stream only the selected
+        columns in chunks and keep only the rows that match the dataset. Does not require user input.
+        :param chunksize: Number of rows per chunk when streaming.
         """
         # ToDo: Eventually, could implement a more robust handling of fiscal year data, that retains information on year
         #  end month and fiscal year in the final dataset.
-        if not self._download_annuals():
-            raise NoDatasetError('Downloading company information (annual) failed. Information could not be merged '
-                                 + 'into your dataset.')
-        if self.dataset is None:
-            raise NoDatasetError('Must first build a dataset.')
-
         selections = [revenue, r_n_d, wages_and_salaries, total_assets, fiscal_year_end, COGS, EBIT, EBITDA, TIC]
         all_info_columns = ['revt', 'xrd', 'xstfws', 'ct', 'fyrc', 'cogs', 'ebit', 'ebitda', 'tic']
         selected_columns = list(compress(all_info_columns, selections))
 
+        renames = {column: self._annuals_renames.get(column, column) for column in selected_columns}
+        if self._deferred():
+            self._plan.add_annuals(self._observation_years())
+            self._plan.add_columns('annuals', {target: 'f.' + source for source, target in renames.items()})
+            return
+        if self.dataset is None:
+            raise NoDatasetError('Must first build a dataset.')
+
         # Add the columns we are merging on
         selected_columns = selected_columns + ['gvkey', 'fyear']
 
-        if 'year' in list(self.dataset):
-            self.dataset = self.dataset.merge(
-                # For some reason, the FUNDA table has some duplicate rows with mostly nan values. For efficient memory
-                # use, we perform a lot of steps at once.
-                # ToDo: Benchmark efficiency of this approach vs more readable approach.
-                self._annuals_table[selected_columns].rename({'fyear': 'year'}, axis='columns')
-                    .drop_duplicates(subset=['year', 'gvkey']),
-                how='left', on=['gvkey', 'year'])
+        if stream:
+            join_data = self._stream_annuals(selected_columns, chunksize)
+            if 'year' in list(self.dataset):
+                self._attach_columns(join_data, renames, on=['gvkey', 'year'], table_on=['gvkey', 'fyear'])
+            else:
+                self.dataset = pd.merge(self.dataset, join_data.rename({'fyear': 'year'}, axis='columns'),
+                                        how='left', on=['gvkey'])
+
+        elif not self._download_annuals(columns=selected_columns, gvkeys=self.dataset['gvkey'].unique(),
+                                        years=self._dataset_years() if 'year' in list(self.dataset)
+                                        else self._observation_years()):
+            raise NoDatasetError('Downloading company information (annual) failed. Information could not be merged '
+                                 + 'into your dataset.')
+
+        elif 'year' in list(self.dataset):
+            # For some reason, the FUNDA table has some duplicate rows with mostly nan values. Only the first row per
+            # company-year is used.
+            self._attach_columns(self._annuals_table, renames, on=['gvkey', 'year'], table_on=['gvkey', 'fyear'],
+                                 cache_name='annuals')
 
         else:
             join_data = self._annuals_table[selected_columns].copy()
@@ -387,28 +679,41 @@ class WrdsConnection:
                                     .drop_duplicates(subset=['year', 'gvkey']),
                          how='left', on=['gvkey'])
 
-        self.dataset.reset_index(drop=True, inplace=True)
-
-        # ToDo make mapping dictionary an attribute of the WrdsConnection object. Then, use self.attribute_name below.
-        self.dataset = self.dataset.rename({'revt': 'revenue', 'xrd': 'r_n_d', 'xstfws': 'wages_and_salaries',
-                                            'act': 'total_assets', 'fyrc': 'fiscal_year_end', 'tic': 'ticker'},
-                                           axis='columns')
+        self.dataset = self.dataset.rename(self._annuals_renames, axis='columns')
+        self._sort_dataset()
 
+    @instrumented
     def add_address(self):
         """
-        Add company addresses, where available. The addresses contain four rows, separated by a newline character "\\n".
+        Add company addresses, where available. The addresses contain up to four rows, separated by a newline character
+        "\\n". Missing rows are left out.
         """
-        self._download_company_table()
+        if self._deferred():
+            self._plan.add_columns('company', {'address': self._company_expressions['address'].format(table='c.')})
+            return
 
-        address = (self._company_table.add1 + '\n' + self._company_table.add2 + '\n' + self._company_table.add3 +
-                   '\n' + self._company_table.add4)
-        address_and_gvkey = pd.concat([address, self._company_table['gvkey']], axis=1)
-        self.dataset = pd.merge(self.dataset, address_and_gvkey, how='left', on=['gvkey'])
+        self._collect_prefetched('company')
+        if self._company_table is not None and not self._company_projected:
+            # The full table is already held (e.g., prefetched), so the address is built from it instead of downloaded.
+            lines = self._company_table[['add1', 'add2', 'add3', 'add4']].stack().dropna()
+            address = lines.groupby(level=0).agg('\n'.join).reindex(self._company_table.index)
+            address_and_gvkey = pd.DataFrame({'gvkey': self._company_table['gvkey'], 'address': address})
+        else:
+            # Only the gvkey and the address, which is computed on the server, are downloaded.
+            self._download_company_table(['address'])
+            address_and_gvkey = self._company_table
+        self._attach_columns(address_and_gvkey, {'address': 'address'}, on=['gvkey'])
 
+    @instrumented
     def load_gvkeys(self, gvkeys: tuple):
         """
         Provide a tuple of gvkeys and start building your sample from there.
         """
+        if self._plan is not None:
+            params = {'gvkey_{0}'.format(i): gvkey for i, gvkey in enumerate(gvkeys)}
+            values = ', '.join('(%({0})s)'.format(name) for name in params)
+            self._plan.set_sample('select column1 as gvkey from (values {0}) as gvkeys'.format(values), params)
+            return
         gvkeys = pd.DataFrame(gvkeys)
         if self.dataset and 'gvkey' in self.dataset:
             self.dataset = pd.merge([self.dataset, gvkeys], how='outer')
@@ -417,6 +722,7 @@ class WrdsConnection:
         else:
             self.dataset = gvkeys
 
+    @instrumented
     def _download_names_table(self):
         """
         Pulls data from the "NAMES" table in compustat's "COMPA" library. The table matches gvkeys, which are used
@@ -424,46 +730,611 @@ class WrdsConnection:
         include the ticker (tic), the cusip (Committee on Uniform Security Identification Procedures) code, the cik
         number (which is also used for identification purposes), and the SIC and NAICS industry identifiers.
         """
+        self._collect_prefetched('names')
         if self._names_table is None:
-            self._names_table = self.db.get_table(library='compa', table='names')
+            self._names_table = self._get_table(library='compa', table='names')
 
-    def _download_company_table(self):
+    @instrumented
+    def _download_company_table(self, columns: list = None):
         """
         Pulls data from the "COMPANY" table in compustat's "COMPA" library. The table contains basic demographics, such
         as addresses, advanced industry classifiers, and the url of the corporate website.
+        :param columns: Columns to download, which can include the fields in _company_expressions. Only the columns that
+        are not held yet are downloaded, together with the gvkey, and added to the held table. If not provided, the full
+        table is downloaded.
         """
+        self._collect_prefetched('company')
+        if columns is None:
+            if self._company_table is None or self._company_projected:
+                self._company_table = self._get_table(library='compa', table='company')
+                self._company_projected = False
+            return
+
+        held = list(self._company_table) if self._company_table is not None else []
+        missing = [column for column in columns if column not in held and column != 'gvkey']
+        if self._company_table is not None and not missing:
+            return
+        selected = ['gvkey'] + ['{0} as {1}'.format(self._company_expressions[column].format(table=''), column)
+                                if column in self._company_expressions else column for column in missing]
+        df = self._get_table(library='compa', table='company', columns=selected)
         if self._company_table is None:
-            self._company_table = self.db.get_table(library='compa', table='company')
+            self._company_table, self._company_projected = df, True
+        else:
+            # The gvkey is the key of the table, so that the merge adds one value to every held row.
+            self._company_table = self._company_table.merge(df, on='gvkey', how='left')
 
-    def _download_executive_table(self):
+    @instrumented
+    def _download_executive_table(self, gvkeys=None, years: tuple = (None, None)):
         """
         Pulls data from the "ANNCOMP" table in compustat's "EXECCOMP" library. The table contains information on company
         executives, such as name, years of service, salary, bonuses, and similar data.
+        :param gvkeys: If provided, only the executives of these companies are downloaded.
+        :param years: Tuple with the first and last year to download. Either may be None.
         :return:
         """
-        if self._executive_table is None:
-            self._executive_table = self.db.get_table(library='execcomp', table='anncomp')
-            self._executive_table['year'] = self._executive_table['year'].astype('Int64')
+        self._collect_prefetched('executives')
+        if not self._scope_covers(self._executive_scope, gvkeys, years):
+            if gvkeys is None:
+                self._executive_table = self._get_table(library='execcomp', table='anncomp')
+                years = (None, None)
+            else:
+                self._executive_table = self._get_table_for_gvkeys(library='execcomp', table='anncomp',
+                                                                   gvkeys=gvkeys, year_column='year', years=years)
+            self._executive_scope = (self._as_key_set(gvkeys), years, None)
 
-    def _download_annuals(self):
+    @instrumented
+    def _download_annuals(self, columns: list = None, gvkeys=None, years: tuple = (None, None)):
         """
         Downloads data from the "FUNDA" (fundamentals annual) table in compustat's "COMPA" (company annual) library. The
         table contains company-year observations on balance sheet items, incomer statement items, and cash flow items,
-        etc.
+        etc. If gvkeys are provided, only the rows of these companies are downloaded. Otherwise, the full table is
+        downloaded after the user confirms.
         See also: https://wrds-web.wharton.upenn.edu/wrds/ds/comp/funda/index.cfm?navId=80#variablesTab
+        :param columns: Columns to download. If not provided, all columns are downloaded.
+        :param gvkeys: If provided, only the rows of these companies are downloaded.
+        :param years: Tuple with the first and last fiscal year to download. Either may be None.
         :return: Returns True if data has been made available, and False if not.
         """
+        self._collect_prefetched('annuals')
+        if self._scope_covers(self._annuals_scope, gvkeys, years, columns):
+            return True
+
+        if gvkeys is not None:
+            self._annuals_table = self._get_table_for_gvkeys(library='compa', table='funda', gvkeys=gvkeys,
+                                                             columns=columns, year_column='fyear', years=years)
+            self._annuals_scope = (self._as_key_set(gvkeys), years, set(columns) if columns is not None else None)
+            return True
+
+        if self.cache is not None:
+            self._annuals_table = self.cache.get(library='compa', table='funda', filters=self._cache_filters())
         if self._annuals_table is None:
             confirm = input("Warning: the data table you are about to download is very large. RAM and swap "
                             + "partition usage might increase by 30GB or more. Press y to confirm.")
             if confirm == 'y':
-                self._annuals_table = self.db.get_table(library='compa', table='funda')
-                return True
+                self._annuals_table = self._get_table(library='compa', table='funda')
             else:
                 print('Process aborted. The table has not been downloaded.')
                 return False
+        self._annuals_scope = (None, (None, None), None)
+        return True
+
+    @instrumented
+    def _get_table_for_gvkeys(self, library: str, table: str, gvkeys, columns: list = None, year_column: str = None,
+                              years: tuple = (None, None), values: dict = None):
+        """
+        Returns the rows of a table that belong to a set of companies, and optionally to a range of years, from the
+        shared table store, or downloads them (see _load_table_for_gvkeys).
+        :return: Pandas dataframe.
+        """
+        filters = {'gvkey': sorted(self._as_key_set(gvkeys)), 'values': values}
+        if year_column is not None:
+            filters[year_column] = years
+        return self.table_store.get_or_load(
+            self._store_key(library, table, columns, filters),
+            lambda: self._load_table_for_gvkeys(library, table, gvkeys, columns, year_column, years, values),
+            name='{0}.{1} ({2} gvkeys)'.format(library, table, len(filters['gvkey'])))
+
+    @instrumented
+    def _load_table_for_gvkeys(self, library: str, table: str, gvkeys, columns: list = None, year_column: str = None,
+                               years: tuple = (None, None), values: dict = None):
+        """
+        Downloads the rows of a table that belong to a set of companies, and optionally to a range of years. Small sets
+        of gvkeys are sent to the server in batches of "gvkey in (...)" lists. Larger sets are uploaded into a temporary
+        table on the server, which the table is then joined with.
+        :param library: Name of the library on the WRDS server.
+        :param table: Name of the table.
+        :param gvkeys: The gvkeys of the companies.
+        :param columns: Columns to download. If not provided, all columns are downloaded.
+        :param year_column: Name of the year column of the table, used to filter for years.
+        :param years: Tuple with the first and last year to download. Either may be None.
+        :param values: Dictionary mapping columns to lists of values. Only rows with one of the listed values in each of
+        these columns are downloaded.
+        :return: Pandas dataframe.
+        """
+        gvkeys = sorted(self._as_key_set(gvkeys))
+        values = values if values is not None else {}
+        filters = self._cache_filters({'gvkey': gvkeys})
+        if year_column is not None:
+            filters[year_column] = years
+        if values:
+            filters['values'] = {column: sorted(map(str, column_values)) for column, column_values in values.items()}
+        if self.cache is not None:
+            df = self.cache.get(library=library, table=table, columns=columns, filters=filters)
+            if df is not None:
+                return df
+
+        conditions, params = [], {}
+        first_year, last_year = years
+        if first_year is not None:
+            conditions.append('{0} >= %(first_year)s'.format(year_column))
+            params['first_year'] = first_year
+        if last_year is not None:
+            conditions.append('{0} <= %(last_year)s'.format(year_column))
+            params['last_year'] = last_year
+        for column, column_values in values.items():
+            conditions.append('{0} in %(values_{0})s'.format(column))
+            params['values_' + column] = tuple(column_values)
+        select = 'select {columns} from {library}.{table}'.format(
+            columns=', '.join(columns) if columns is not None else '*', library=library, table=table)
+
+        if len(gvkeys) <= self.temp_table_threshold:
+            batches = []
+            for start in range(0, len(gvkeys), self.in_list_size):
+                batch_params = dict(params, gvkeys=tuple(gvkeys[start:start + self.in_list_size]))
+                sql = select + ' where ' + ' and '.join(['gvkey in %(gvkeys)s'] + conditions)
+                batches.append(apply_dtypes(self._read_sql(sql, params=batch_params), table, self.compact_floats))
+            df = concat_tables(batches) if batches else self._read_sql(select + ' limit 0')
         else:
-            return True
+            # Temporary tables only exist within the session of the connection that created them, so the upload and
+            # the query run on the same pooled connection. The table is dropped before the connection is returned. If
+            # the connection is lost, the table is lost with it, and the upload is repeated on the new connection.
+            sql = select + ' where ' + ' and '.join(['gvkey in (select gvkey from sample_gvkeys)'] + conditions)
+
+            def run():
+                with self.db.engine.connect() as connection:
+                    connection.exec_driver_sql('create temporary table sample_gvkeys (gvkey varchar(6) primary key)')
+                    try:
+                        connection.exec_driver_sql('insert into sample_gvkeys (gvkey) values (%(gvkey)s)',
+                                                   [{'gvkey': gvkey} for gvkey in gvkeys])
+                        return pd.read_sql_query(sql, connection, params=params)
+                    finally:
+                        connection.exec_driver_sql('drop table sample_gvkeys')
+                        connection.commit()
+            df = apply_dtypes(self._with_reconnect(run), table, self.compact_floats)
+            self._record_query(sql, df)
+
+        if self.cache is not None:
+            self.cache.put(df, library=library, table=table, columns=columns, filters=filters)
+        return df
+
+    @staticmethod
+    def _as_key_set(gvkeys):
+        """
+        :return: The gvkeys as a set of strings, or None if no gvkeys are provided.
+        """
+        if gvkeys is None:
+            return None
+        return {gvkey for gvkey in gvkeys if isinstance(gvkey, str)}
+
+    @staticmethod
+    def _scope_covers(scope: tuple, gvkeys, years: tuple, columns: list = None):
+        """
+        Checks whether a table that has been downloaded for one scope (gvkeys, years and columns) holds all rows and
+        columns requested for another.
+        :param scope: Tuple of the gvkey set, year range and column set of the downloaded table, or None if the table
+        has not been downloaded. None for the gvkeys or columns stands for all gvkeys or columns.
+        :return: True if the downloaded table covers the request.
+        """
+        if scope is None:
+            return False
+        held_gvkeys, (held_first_year, held_last_year), held_columns = scope
+        first_year, last_year = years
+        if held_gvkeys is not None and (gvkeys is None or not WrdsConnection._as_key_set(gvkeys) <= held_gvkeys):
+            return False
+        if held_columns is not None and (columns is None or not set(columns) <= held_columns):
+            return False
+        if held_first_year is not None and (first_year is None or first_year < held_first_year):
+            return False
+        if held_last_year is not None and (last_year is None or last_year > held_last_year):
+            return False
+        return True
+
+    @instrumented
+    def _stream_annuals(self, columns: list, chunksize=100000):
+        """
+        Streams selected columns from the "FUNDA" (fundamentals annual) table in compustat's "COMPA" library, without
+        holding the full table in memory. Every chunk is reduced to the companies in the dataset and to the observation
+        period (or to the years in the dataset, if it already has a year column), and duplicate company-years are
+        dropped, before the next chunk is fetched.
+        :param columns: Columns to download. Must include gvkey and fyear.
+        :param chunksize: Number of rows per chunk. Caps the memory used by the download.
+        :return: Dataframe with the matching company-year observations.
+        """
+        gvkeys = self.dataset['gvkey'].unique()
+        years = self.dataset['year'].dropna().unique() if 'year' in list(self.dataset) else None
+
+        filters = self._cache_filters({'gvkey': sorted(gvkeys),
+                                       'fyear': sorted(years) if years is not None else [self.observation_start_date,
+                                                                                          self.observation_end_date]})
+        if self.cache is not None:
+            cached = self.cache.get(library='compa', table='funda', columns=columns, filters=filters)
+            if cached is not None:
+                return cached
+
+        if years is None and (self.observation_start_date is None) and (self.observation_end_date is None):
+            print('No observation period specified. Will return all available observations.')
+
+        sql = 'select {columns} from compa.funda'.format(columns=', '.join(columns))
+        kept_chunks = []
+        for chunk in self._stream_sql(sql, chunksize=chunksize):
+            chunk = chunk[chunk['gvkey'].isin(gvkeys)]
+            if years is not None:
+                chunk = chunk[chunk['fyear'].isin(years)]
+            else:
+                chunk = self._filter_observation_period(chunk, pd.to_datetime(chunk['fyear'], format='%Y'),
+                                                        verbose=False)
+            # For some reason, the FUNDA table has some duplicate rows with mostly nan values.
+            kept_chunks.append(apply_dtypes(chunk.drop_duplicates(subset=['gvkey', 'fyear']), 'funda',
+                                            self.compact_floats))
+
+        if not kept_chunks:
+            annuals = pd.DataFrame(columns=columns)
+        else:
+            # Duplicates can also span two chunks.
+            annuals = concat_tables(kept_chunks).drop_duplicates(subset=['gvkey', 'fyear'])
+
+        if self.cache is not None:
+            self.cache.put(annuals, library='compa', table='funda', columns=columns, filters=filters)
+        return annuals
+
+    @instrumented
+    def prefetch(self, tables: list = ('names', 'company', 'executives'), max_workers=4):
+        """
+        Starts downloading tables in the background, so that several tables are downloaded at the same time. Each
+        download runs on its own thread and database connection. Methods that need one of the tables wait only for that
+        table's download to finish.
+        If a dataset has already been built, the executive and annual tables are only downloaded for the companies in
+        the dataset and the observation period.
+        :param tables: Tables to download: any of 'names', 'company', 'executives' and 'annuals'. The annual table
+        ("FUNDA") is only prefetched for an existing dataset, as the full table is very large.
+        :param max_workers: Maximum number of downloads that run at the same time.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wrds_prefetch')
+
+        gvkeys = self.dataset['gvkey'].unique() if isinstance(self.dataset, DataFrame) else None
+        loaded = {'names': self._names_table is not None, 'company': self._company_table is not None,
+                  'executives': self._executive_scope is not None, 'annuals': self._annuals_scope is not None}
+
+        for table in tables:
+            if table not in loaded:
+                raise ValueError('Unknown table: {0}. Available tables: {1}.'.format(table, list(loaded)))
+            if table == 'annuals' and gvkeys is None:
+                raise NoDatasetError('Must first build a dataset to prefetch the annual table.')
+            if not loaded[table] and table not in self._prefetched:
+                self._prefetched[table] = self._executor.submit(self._prefetch_download, table, gvkeys,
+                                                                self._observation_years())
+
+    @instrumented
+    def _prefetch_download(self, table: str, gvkeys, years: tuple):
+        """
+        Downloads a table for prefetch. Runs on a background thread, so it does not change the state of the connection.
+        :return: Tuple of the table and the scope it covers (see _scope_covers).
+        """
+        if table == 'names':
+            return self._get_table(library='compa', table='names'), None
+        if table == 'company':
+            return self._get_table(library='compa', table='company'), None
+        if table == 'executives' and gvkeys is None:
+            return self._get_table(library='execcomp', table='anncomp'), (None, (None, None), None)
+
+        library, table_name, year_column = {'executives': ('execcomp', 'anncomp', 'year'),
+                                            'annuals': ('compa', 'funda', 'fyear')}[table]
+        df = self._get_table_for_gvkeys(library=library, table=table_name, gvkeys=gvkeys, year_column=year_column,
+                                        years=years)
+        return df, (self._as_key_set(gvkeys), years, None)
+
+    @instrumented
+    def _collect_prefetched(self, table: str):
+        """
+        Waits for the background download of a table started by prefetch, if there is one, and stores the table.
+        :param table: One of 'names', 'company', 'executives' and 'annuals'.
+        """
+        future = self._prefetched.pop(table, None)
+        if future is None:
+            return
+        df, scope = future.result()
+        if table == 'names':
+            self._names_table = df
+        elif table == 'company':
+            self._company_table = df
+        elif table == 'executives':
+            self._executive_table, self._executive_scope = df, scope
+        elif table == 'annuals':
+            self._annuals_table, self._annuals_scope = df, scope
+
+    def _read_sql(self, sql: str, params: dict = None):
+        """
+        Runs a query on a connection from the connection pool of the WRDS connection. Unlike db.raw_sql, which always
+        uses the same connection, this can be called from several threads at once.
+        :param sql: SQL query.
+        :param params: Query parameters.
+        :return: Pandas dataframe.
+        """
+        def run():
+            with self.db.engine.connect() as connection:
+                return pd.read_sql_query(sql, connection, params=params)
+        df = self._with_reconnect(run)
+        self._record_query(sql, df)
+        return df
+
+    def _with_reconnect(self, run):
+        """
+        Runs a function that queries the WRDS server. If the connection to the server has been lost, it is opened again
+        and the function is run once more. Connections that were passed in with the db parameter are not replaced.
+        :param run: Function without arguments, which opens the connection it uses from self.db.
+        :return: The result of the function.
+        """
+        try:
+            return run()
+        except Exception as error:
+            if not (self._reconnect and self._lost_connection(error)):
+                raise
+            print('Lost the connection to WRDS. Connecting again.')
+            self._close_connection()
+            return run()
+
+    @staticmethod
+    def _lost_connection(error: BaseException):
+        """
+        :return: Whether an error was caused by a lost connection, which SQLAlchemy marks as connection_invalidated.
+        pandas wraps the errors of SQLAlchemy in errors of its own, and errors in cleanup code (e.g., dropping a
+        temporary table) replace the original error, so the errors that caused or preceded the error are checked too.
+        """
+        seen = set()
+        while error is not None and id(error) not in seen:
+            if getattr(error, 'connection_invalidated', False):
+                return True
+            seen.add(id(error))
+            error = error.__cause__ if error.__cause__ is not None else error.__context__
+        return False
+
+    def _close_connection(self):
+        """
+        Closes the connection to WRDS, if it is open. The next query opens a new connection.
+        """
+        with self._connect_lock:
+            if self._db is not None:
+                try:
+                    self._db.close()
+                except Exception:
+                    # A connection that has been lost may fail to close. It is replaced in any case.
+                    pass
+                self._db = None
+
+    def _record_query(self, sql: str, df: DataFrame = None):
+        """
+        Records a query in the instrumentation of the connection, if one is attached.
+        :param sql: The query, or None to only record the size of another part of the result of a query.
+        :param df: The result of the query.
+        """
+        if self.instrumentation is not None:
+            self.instrumentation.record_query(sql, df)
+
+    @instrumented
+    def _get_table(self, library: str, table: str, columns: list = None):
+        """
+        Returns a table from the shared table store, or downloads it (see _load_table).
+        :return: Pandas dataframe.
+        """
+        return self.table_store.get_or_load(self._store_key(library, table, columns),
+                                            lambda: self._load_table(library, table, columns),
+                                            name='{0}.{1}'.format(library, table))
+
+    def _cache_filters(self, filters: dict = None):
+        """
+        :return: The filters under which a table is stored in the table cache, including whether its floats are
+        compact, so that connections with and without compact floats do not load each other's tables.
+        """
+        return dict(filters if filters is not None else {}, compact_floats=self.compact_floats)
+
+    def _store_key(self, library: str, table: str, columns: list = None, filters: dict = None):
+        """
+        :return: Key of a table in the shared table store. Tables with compact floats, and tables from other sources
+        (see _table_source), are stored separately.
+        """
+        return TableCache.key(library, table, columns, filters), self.compact_floats, self._table_source()
+
+    def _table_source(self):
+        """
+        :return: Identifies where the tables of the connection come from: the WRDS user, or the database connection that
+        was passed in, and the table cache. Connections to different databases never share tables in the table store,
+        and neither do connections with different caches, which may hold older versions of a table.
+        """
+        if self._reconnect:
+            database = ('wrds', self.username)
+        else:
+            try:
+                database = ('db', _passed_databases.setdefault(self._db, next(_database_numbers)))
+            except TypeError:
+                # Database connections that cannot be weakly referenced are not shared with other WrdsConnections.
+                if '_own_source' not in self.__dict__:
+                    self._own_source = next(_database_numbers)
+                database = ('connection', self._own_source)
+        cache = (self.cache.directory, self.cache.ttl) if self.cache is not None else None
+        return database, cache
+
+    @instrumented
+    def _load_table(self, library: str, table: str, columns: list = None):
+        """
+        Downloads a table from the WRDS server, or loads it from the table cache if one is attached and holds a current
+        copy of the table.
+        :param library: Name of the library on the WRDS server.
+        :param table: Name of the table.
+        :param columns: Columns to download. If not provided, all columns are downloaded.
+        :return: Pandas dataframe.
+        """
+        if self.cache is not None:
+            df = self.cache.get(library=library, table=table, columns=columns, filters=self._cache_filters())
+            if df is not None:
+                return df
+
+        if self.checkpoints is not None and table in self._range_columns:
+            df = self._get_table_in_ranges(library, table, self._range_columns[table], columns)
+        else:
+            df = self._read_sql('select {columns} from {library}.{table}'.format(
+                columns=', '.join(columns) if columns is not None else '*', library=library, table=table))
+            apply_dtypes(df, table, self.compact_floats)
+        if self.cache is not None:
+            self.cache.put(df, library=library, table=table, columns=columns, filters=self._cache_filters())
+        return df
+
+    @instrumented
+    def sync_table(self, table: str, lookback_years=1):
+        """
+        Brings the copy of a table in the table cache up to date, by downloading only the rows that can have changed
+        since the last sync. The latest fiscal year (or, for the index constituents, the latest date) in the stored
+        table is recorded as its high-water mark. A sync downloads the rows from lookback_years before the high-water
+        mark onward, and the rows without a year or date (e.g., companies that are still in an index), and replaces
+        these rows in the stored table. The first sync of a table downloads the full table.
+        Afterwards, the connection and all other connections that use the cache load the synced table.
+        :param table: One of 'funda', 'anncomp' and 'idxcst_his'.
+        :param lookback_years: Number of years before the high-water mark that are downloaded again, as WRDS revises
+        the data of recent years.
+        :return: Pandas dataframe with the synced table.
+        """
+        if table not in self._sync_columns:
+            raise ValueError('Unknown table: {0}. Available tables: {1}.'.format(table, list(self._sync_columns)))
+        if self.cache is None:
+            raise ValueError('Syncing a table requires a table cache to store the table in.')
+        library, columns, kind = self._sync_columns[table]
+
+        stored = self.cache.get(library=library, table=table, filters=self._cache_filters())
+        metadata = self.cache.metadata(library=library, table=table, filters=self._cache_filters()) or {}
+        high_water_mark = metadata.get('high_water_mark')
+        if stored is None or high_water_mark is None:
+            print('No synced copy of {0}.{1} found. Downloading the full table.'.format(library, table))
+            df = self._read_sql('select * from {0}.{1}'.format(library, table))
+        else:
+            since = high_water_mark - lookback_years if kind == 'year' else \
+                (pd.Timestamp(high_water_mark) - pd.DateOffset(years=lookback_years)).date()
+            changed = ' or '.join('"{0}" is null or "{0}" >= %(since)s'.format(column) for column in columns)
+            update = self._read_sql('select * from {0}.{1} where {2}'.format(library, table, changed),
+                                    params={'since': since})
+            values = [stored[column] if kind == 'year' else pd.to_datetime(stored[column]) for column in columns]
+            unchanged = np.logical_and.reduce([(value < (since if kind == 'year' else pd.Timestamp(since)))
+                                               .fillna(False).to_numpy(dtype=bool) for value in values])
+            print('Synced {0}.{1}: {2} rows downloaded from {3} onward.'.format(library, table, len(update), since))
+            # An empty update has no column types, which would turn the columns of the stored table into object columns.
+            df = concat_tables([stored[unchanged]] + ([apply_dtypes(update, table, self.compact_floats)]
+                                                      if len(update) else []))
+        apply_dtypes(df, table, self.compact_floats)
+
+        latest = max(value for value in (df[column].max() for column in columns) if not pd.isna(value))
+        self.cache.put(df, library=library, table=table, filters=self._cache_filters(),
+                       high_water_mark=int(latest) if kind == 'year' else pd.Timestamp(latest).date().isoformat(),
+                       synced=datetime.now().isoformat())
+        df = self.table_store.put(self._store_key(library, table), df, name='{0}.{1}'.format(library, table))
+
+        # Full copies of the table held by the connection are replaced.
+        if table == 'anncomp' and self._executive_scope == (None, (None, None), None):
+            self._executive_table = df
+        if table == 'funda' and self._annuals_scope == (None, (None, None), None):
+            self._annuals_table = df
+        if table == 'idxcst_his':
+            self._memberships = {}
+        return df
+
+    @instrumented
+    def _get_table_in_ranges(self, library: str, table: str, year_column: str, columns: list = None):
+        """
+        Downloads a table in ranges of checkpoint_years years, and stores every finished range in the checkpoint
+        directory. Ranges that were finished by an earlier, interrupted download are loaded from the checkpoint
+        directory instead. The ranges start at multiples of checkpoint_years, so that they are the same every time the
+        download is started. Rows without a year are downloaded as a range of their own.
+        :param library: Name of the library on the WRDS server.
+        :param table: Name of the table.
+        :param year_column: Name of the year column of the table.
+        :param columns: Columns to download. If not provided, all columns are downloaded.
+        :return: Pandas dataframe.
+        """
+        bounds = self._read_sql('select min({0}) as first_year, max({0}) as last_year from {1}.{2}'.format(
+            year_column, library, table))
+        first_year, last_year = bounds['first_year'].iloc[0], bounds['last_year'].iloc[0]
+        ranges = [(None, None)]
+        if not pd.isna(first_year):
+            first_year, last_year = int(first_year), int(last_year)
+            ranges += [(start, start + self.checkpoint_years - 1) for start in
+                       range(first_year - first_year % self.checkpoint_years, last_year + 1, self.checkpoint_years)]
+
+        select = 'select {columns} from {library}.{table}'.format(
+            columns=', '.join(columns) if columns is not None else '*', library=library, table=table)
+        # Parts with compact floats are stored separately, so that they are not resumed into a download without.
+        filters = self._cache_filters()
+        parts = []
+        for first, last in ranges:
+            part_name = '{0}-{1}'.format(first, last) if first is not None else 'no_year'
+            part = self.checkpoints.load(library, table, part_name, columns, filters)
+            if part is None:
+                if first is None:
+                    sql, params = select + ' where {0} is null'.format(year_column), None
+                else:
+                    sql = select + ' where {0} >= %(first_year)s and {0} <= %(last_year)s'.format(year_column)
+                    params = {'first_year': first, 'last_year': last}
+                part = apply_dtypes(self._read_sql(sql, params=params), table, self.compact_floats)
+                self.checkpoints.save(part, library, table, part_name, columns, filters)
+            else:
+                print('Resuming download of {0}.{1}: years {2} loaded from checkpoint.'.format(library, table,
+                                                                                            part_name))
+            parts.append(part)
+
+        # Empty ranges have no column types, which would turn the columns of the other ranges into object columns.
+        df = concat_tables([part for part in parts if len(part)] or parts)
+        self.checkpoints.clear(library, table, columns, filters)
+        return df
+
+    def _stream_sql(self, sql: str, params: dict = None, chunksize=100000):
+        """
+        Runs a query through a server-side cursor and yields the result in chunks, so that only one chunk is held in
+        memory at a time. The query runs on a separate connection from the connection pool, as a streaming cursor
+        occupies its connection until it is exhausted.
+        If the connection is lost before the first chunk has arrived, it is opened again and the query is run once
+        more. Once chunks have been yielded, a lost connection raises an error, as the chunks cannot be taken back.
+        :param sql: SQL query.
+        :param params: Query parameters.
+        :param chunksize: Number of rows per chunk.
+        :return: Generator of dataframes.
+        """
+        for attempt in range(2):
+            started = False
+            try:
+                with self.db.engine.connect() as connection:
+                    connection = connection.execution_options(stream_results=True, max_row_buffer=chunksize)
+                    for number, chunk in enumerate(pd.read_sql_query(sql, connection, params=params,
+                                                                     chunksize=chunksize)):
+                        # The query is recorded once, and the size of every chunk is added to the transferred bytes.
+                        self._record_query(sql if number == 0 else None, chunk)
+                        started = True
+                        yield chunk
+                return
+            except Exception as error:
+                if attempt > 0 or started or not (self._reconnect and self._lost_connection(error)):
+                    raise
+                print('Lost the connection to WRDS. Connecting again.')
+                self._close_connection()
+
+    def memory_report(self):
+        """
+        Reports the memory used by the dataset and by the tables downloaded from WRDS.
+        :return: Pandas dataframe with the number of rows, columns and bytes (including the contents of string columns)
+        of every table that is held in memory.
+        """
+        tables = {'dataset': self.dataset, 'names': self._names_table, 'company': self._company_table,
+                  'anncomp': self._executive_table, 'funda': self._annuals_table}
+        report = DataFrame([{'table': name, 'rows': len(df), 'columns': df.shape[1], 'bytes': memory_usage(df)}
+                            for name, df in tables.items() if isinstance(df, DataFrame)],
+                           columns=['table', 'rows', 'columns', 'bytes'])
+        return report.set_index('table')
 
     def return_dataframe(self):
         """
@@ -472,15 +1343,52 @@ class WrdsConnection:
         """
         return self.dataset
 
-    def filter_by_industry(self, industry_code: str, classification_system: str):
+    @instrumented
+    def export_dataset(self, path: str, file_format='parquet', partition_by_year=True, row_group_size=100000,
+                       overwrite=False):
+        """
+        Writes the dataset to disk, as Parquet files partitioned by year or as a Feather file, in row groups, without
+        making a copy of the full dataset. Load the dataset with wrds_tools.load_dataset, which only reads the columns and
+        years that are requested. Requires pyarrow.
+        :param path: Directory (Parquet) or file (Feather) to write to.
+        :param file_format: 'parquet' or 'feather'.
+        :param partition_by_year: Write one directory per year, if the dataset has a year column (Parquet only).
+        :param row_group_size: Number of rows that are converted and written at a time.
+        :param overwrite: Replace existing output. Otherwise, existing output raises an error.
+        """
+        if not isinstance(self.dataset, DataFrame):
+            raise NoDatasetError('No dataset downloaded yet. Cannot export dataset.')
+        write_dataset(self.dataset, path, file_format=file_format, partition_by_year=partition_by_year,
+                      row_group_size=row_group_size, overwrite=overwrite)
+
+    @instrumented
+    def filter_by_industry(self, industry_code: str, classification_system: str, pushdown=False):
         """
         Only keep companies within certain industry (or industries).
         :param industry_code: An industry code (string) or a list of industry codes (strings) that should be selected.
         :param classification_system: The classification system that the industry code is in.
+        :param pushdown: Instead of downloading the full "NAMES" (and "COMPANY") table and adding all classifiers of the
+        classification system, look up on the WRDS server which companies of the dataset have one of the industry codes.
+        Only the column of the classification system is added, for the companies that are kept. Filtering with pushdown
+        before adding other information keeps all later downloads and joins small.
         """
+        if self._deferred():
+            self.add_industry_classifiers(get_gics=classification_system.startswith('GICS'),
+                                          get_sp=classification_system.startswith('SP'))
+            expression = {**self._plan.names_columns, **self._plan.company_columns}[classification_system]
+            if type(industry_code) == list:
+                self._plan.add_condition('{0} in %(industry_codes)s'.format(expression),
+                                         {'industry_codes': tuple(industry_code)})
+            if type(industry_code) == str:
+                self._plan.add_condition('{0} = %(industry_code)s'.format(expression), {'industry_code': industry_code})
+            return
         if not isinstance(self.dataset, DataFrame):
             raise NoDatasetError('No dataset downloaded yet. Cannot perform operation on dataset.')
 
+        if pushdown and classification_system not in list(self.dataset):
+            self._filter_by_industry_on_server(industry_code, classification_system)
+            return
+
         # First, we make sure that the industry classification system we want to filter by is already in the dataset.
         if classification_system in ['SIC', 'NAICS'] and 'SIC' not in list(self.dataset):
             print('Downloading SIC and NAICS industry classifiers.')
@@ -497,18 +1405,127 @@ class WrdsConnection:
             self.dataset = self.dataset[self.dataset[classification_system].isin(industry_code)]
         if type(industry_code) == str:
             self.dataset = self.dataset[self.dataset[classification_system] == industry_code]
-        self.dataset.reset_index(drop=True, inplace=True)
+        self.dataset = self.dataset.reset_index(drop=True)
+
+    @instrumented
+    def _filter_by_industry_on_server(self, industry_code, classification_system: str):
+        """
+        Filters the dataset by industry with a query on the WRDS server, see filter_by_industry.
+        """
+        if classification_system not in self._classifier_sources:
+            raise ValueError('Unknown classification system: {0}. Available systems: {1}.'.format(
+                classification_system, list(self._classifier_sources)))
+        table, column = self._classifier_sources[classification_system]
+        industry_codes = [industry_code] if isinstance(industry_code, str) else list(industry_code)
+
+        matches = self._get_table_for_gvkeys(library='compa', table=table, gvkeys=self.dataset['gvkey'].unique(),
+                                             columns=['gvkey', column], values={column: industry_codes})
+        self.dataset = self.dataset[self.dataset['gvkey'].isin(matches['gvkey'])].reset_index(drop=True)
+        self._attach_columns(matches, {column: classification_system}, on=['gvkey'])
+        self._categorize_classifiers()
+
+    @instrumented
+    def _attach_columns(self, table: DataFrame, columns: dict, on: list, table_on: list = None,
+                        cache_name: str = None):
+        """
+        Adds columns from a table to the dataset by looking up the keys of every row in a sorted index of the table.
+        Unlike a merge, this does not copy the dataset: the new columns are attached in place. If a key occurs more than
+        once in the table, the first row is used.
+        :param table: Table that holds the columns.
+        :param columns: Dictionary mapping columns in the table to the names they receive in the dataset.
+        :param on: Key columns in the dataset.
+        :param table_on: Key columns in the table, if they are named differently.
+        :param cache_name: If provided, the index of the table is kept under this name and reused by later calls, as
+        long as the table is not replaced.
+        """
+        table_on = table_on if table_on is not None else on
+        index_key = (cache_name, tuple(table_on))
+        cached = self._lookup_indexes.get(index_key)
+        if cache_name is not None and cached is not None and cached[0]() is table:
+            _, unique_keys, first_rows = cached
+        else:
+            keys = self._key_index(table, table_on)
+            is_first = ~keys.duplicated(keep='first')
+            unique_keys, first_rows = keys[is_first], np.flatnonzero(is_first)
+            order = unique_keys.argsort()
+            unique_keys, first_rows = unique_keys[order], first_rows[order]
+            if cache_name is not None:
+                self._lookup_indexes[index_key] = (weakref.ref(table, self._forget_lookup_index(index_key)),
+                                                   unique_keys, first_rows)
+
+        positions = unique_keys.get_indexer(self._key_index(self.dataset, on))
+        rows = np.where(positions >= 0, first_rows[positions], -1)
+        for column, new_name in columns.items():
+            values = table[column].array if isinstance(table[column].dtype, ExtensionDtype) \
+                else table[column].to_numpy()
+            self.dataset[new_name] = pd.api.extensions.take(values, rows, allow_fill=True)
+
+    def _forget_lookup_index(self, index_key: tuple):
+        """
+        :return: Callback for the weak reference to an indexed table, which removes the index of the table once the
+        table is released (e.g., replaced by a table for another scope or evicted from the table store).
+        """
+        indexes = self._lookup_indexes
+
+        def forget(reference):
+            # A newer table may have been indexed under the same key in the meantime.
+            if index_key in indexes and indexes[index_key][0] is reference:
+                del indexes[index_key]
+        return forget
 
-    def _filter_observation_period(self, df: DataFrame, date_column: pd.Series):
+    @staticmethod
+    def _key_index(df: DataFrame, on: list):
+        """
+        Builds an index from the key columns of a dataframe. Year columns are brought to a common type, as they are
+        stored as integers in some tables and as floats in others.
+        """
+        arrays = [df[key].astype('Int64') if key in ['year', 'fyear'] else df[key] for key in on]
+        if len(arrays) == 1:
+            return pd.Index(arrays[0])
+        return pd.MultiIndex.from_arrays(arrays)
+
+    def _sort_dataset(self):
+        """
+        Sorts the dataset by gvkey and year, after operations that add rows to the dataset.
+        """
+        keys = [key for key in ['gvkey', 'year'] if key in list(self.dataset)]
+        self.dataset = self.dataset.sort_values(keys, kind='stable', ignore_index=True)
+
+    def _dataset_years(self):
+        """
+        :return: Tuple with the first and last year in the dataset, or None for both if the dataset has no years.
+        """
+        if 'year' not in list(self.dataset) or self.dataset['year'].isna().all():
+            return None, None
+        return int(self.dataset['year'].min()), int(self.dataset['year'].max())
+
+    def _observation_years(self):
+        """
+        Translates the observation period into the first and last year that fall within it, for filters on year columns
+        on the server. As in _filter_observation_period, a year counts as within the period if its first day does.
+        :return: Tuple of first and last year. Either is None if the period is open on that end.
+        """
+        first_year, last_year = None, None
+        if self.observation_start_date is not None:
+            start = self.observation_start_date
+            first_year = start.year if (start.month, start.day) == (1, 1) else start.year + 1
+        if self.observation_end_date is not None:
+            last_year = self.observation_end_date.year
+        return first_year, last_year
+
+    @instrumented
+    def _filter_observation_period(self, df: DataFrame, date_column: pd.Series, verbose=True):
         """
         Helper function to filter for observations that are within the observation period (specified via the
         set_observation_period method).
         :param df: Dateframe on which to apply the filter.
         :param date_column: A pandas datetime series.
+        :param verbose: Print a notice if no observation period is specified.
         :return: Dataframe, filtered for the observations that fall within the observation period.
         """
         if (self.observation_start_date is None) and (self.observation_end_date is None):
-            print('No observation period specified. Will return all available observations.')
+            if verbose:
+                print('No observation period specified. Will return all available observations.')
             return df
 
         # We concert the start date to the datetime format, as this is required to compare the date to a pd.Series.